@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+import pygame
+
+from constants import *
+
+
+class AssetCache:
+    """
+    Класс AssetCache загружает каждую текстуру с диска один раз (с convert_alpha) и отдаёт одну и ту же
+    поверхность всем сущностям. Повёрнутые копии берутся из атласа с шагом rotation_step градусов.
+    Размер кэша ограничен max_size, дольше всех не использованные записи вытесняются.
+    Кэш можно заполнять из фонового потока (preload), пока основной поток показывает меню.
+    """
+
+    def __init__(self, max_size=ASSET_CACHE_SIZE, rotation_step=ROTATION_STEP):
+        self.max_size = max_size
+        self.rotation_step = rotation_step
+        self.images = OrderedDict()
+        self.factories = {}
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):  # Достаёт поверхность из кэша или создаёт её через factory
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.misses += 1
+                image = self.images[key] = factory()
+                if len(self.images) > self.max_size:
+                    self.images.popitem(last=False)
+            else:
+                self.hits += 1
+                self.images.move_to_end(key)
+            return image
+
+    def register(self, name, factory):  # Текстура, которая не лежит на диске, а создаётся в коде (например, пуля)
+        self.factories[name] = factory
+
+    def load(self, name):
+        factory = self.factories.get(name)
+        if factory is None:
+            def factory():
+                return pygame.image.load(f'{SPRITES_DIR}/{name}').convert_alpha()
+        return self.get(name, factory)
+
+    def snap_angle(self, angle):  # Угол, округлённый до шага атласа
+        return round(angle / self.rotation_step) * self.rotation_step % 360
+
+    def rotated(self, name, angle):
+        angle = self.snap_angle(angle)
+        if angle == 0:
+            return self.load(name)
+        return self.get((name, angle), lambda: pygame.transform.rotate(self.load(name), angle))
+
+    def precompute_rotations(self, name):  # Заполняет атлас поворотов текстуры заранее
+        for angle in range(0, 360, self.rotation_step):
+            self.rotated(name, angle)
+
+    def preload(self, manifest):  # Загружает текстуры из манифеста {имя: нужен ли атлас поворотов}
+        for name, rotations in manifest.items():
+            if rotations:
+                self.precompute_rotations(name)
+            else:
+                self.load(name)
+
+    def preload_async(self, manifest):  # То же в фоновом потоке. Нужен уже созданный дисплей (convert_alpha)
+        thread = threading.Thread(target=self.preload, args=(manifest,), name='asset-loader', daemon=True)
+        thread.start()
+        return thread
+
+    def clear(self):
+        self.images.clear()
@@ -0,0 +1,113 @@
+import io
+import os
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+from constants import *
+
+MUSIC_END_EVENT = pygame.event.custom_type()  # Своё событие, не пересекается с таймерами меню
+
+
+def check_header(path):  # Быстрая проверка, что файл похож на MP3/OGG/WAV, а не пустой или битый
+    try:
+        with open(path, mode='rb') as file:
+            head = file.read(12)
+    except OSError:
+        return False
+    if path.lower().endswith('.mp3'):
+        return head.startswith(b'ID3') or len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0
+    if path.lower().endswith('.ogg'):
+        return head.startswith(b'OggS')
+    if path.lower().endswith('.wav'):
+        return head.startswith(b'RIFF') and head[8:12] == b'WAVE'
+    return False
+
+
+class Playlist:
+    """
+    Класс Playlist отвечает за фоновую музыку. Папка MUSIC_DIR сканируется, а заголовки файлов проверяются
+    в фоновом потоке. Там же заранее читается в память следующий трек (не больше MUSIC_PREFETCH_MAX_BYTES,
+    более крупные файлы играют потоково с диска). Основной поток только переключает готовые треки,
+    поэтому отсутствующий или битый файл пропускается и никогда не останавливает кадр.
+    """
+
+    def __init__(self, music_dir=MUSIC_DIR, rng=None):
+        self.music_dir = music_dir
+        self.rng = rng or random.Random()
+        self.tracks = deque()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio')
+        self.scanning = None
+        self.next_track = None  # Future с (путь, источник для mixer.music.load)
+        self.current = None
+        self.playing = False
+        self.enabled = True
+
+    def start(self):
+        self.scanning = self.executor.submit(self.scan)
+
+    def scan(self):  # Выполняется в фоновом потоке
+        try:
+            names = sorted(os.listdir(self.music_dir))
+        except OSError as error:
+            print(f'Music disabled: {error}')
+            return
+        paths = [os.path.join(self.music_dir, name) for name in names]
+        paths = [path for path in paths if check_header(path)]
+        self.rng.shuffle(paths)
+        with self.lock:
+            self.tracks.extend(paths)
+        self.prefetch()
+
+    def prefetch(self):  # Ставит следующий трек на подготовку в фоновом потоке
+        with self.lock:
+            if not self.tracks:
+                self.next_track = None
+                return
+            path = self.tracks.popleft()
+            self.tracks.append(path)  # Плейлист крутится по кругу
+        self.next_track = self.executor.submit(self.read, path)
+
+    def read(self, path):
+        try:
+            if os.path.getsize(path) <= MUSIC_PREFETCH_MAX_BYTES:
+                with open(path, mode='rb') as file:
+                    return path, io.BytesIO(file.read())
+        except OSError as error:
+            print(f'Skipping {path}: {error}')
+            return path, None
+        return path, path
+
+    def handle_event(self, event):
+        if event.type == MUSIC_END_EVENT:
+            self.playing = False
+
+    def update(self):  # Вызывается раз в кадр, никогда не ждёт фоновый поток
+        if self.playing or not self.enabled or self.next_track is None or not self.next_track.done():
+            return
+        path, source = self.next_track.result()
+        self.prefetch()
+        if source is None:
+            return
+        try:
+            if isinstance(source, io.BytesIO):
+                pygame.mixer.music.load(source, os.path.splitext(path)[1][1:])
+            else:
+                pygame.mixer.music.load(source)
+            pygame.mixer.music.set_endevent(MUSIC_END_EVENT)
+            pygame.mixer.music.play()
+        except (pygame.error, TypeError) as error:
+            print(f'Skipping {path}: {error}')
+            if not pygame.mixer.get_init():
+                self.enabled = False
+            return
+        self.current = source  # Буфер должен жить, пока трек играет
+        self.playing = True
+        print(f'Now playing: {path}')
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
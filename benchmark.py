@@ -0,0 +1,180 @@
+"""
+Воспроизводимый бенчмарк горячих путей игры: отрисовка карты, поиск пути, проверки стен и попаданий,
+полный кадр (Game.step + Game.render). Работает без окна, результаты печатает в JSON с перцентилями.
+
+Пример запуска:
+    python benchmark.py --enemies 0 50 200 --bullets 0 500 --repeat 200 --output bench_output.txt
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from array import array
+
+import main  # Раньше pygame: main.py прячет приветствие pygame
+import pygame
+from constants import *
+
+
+def percentiles(samples):  # Сводка по замерам в миллисекундах
+    samples = sorted(samples)
+
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+
+    return {
+        'n': len(samples),
+        'mean': sum(samples) / len(samples) * 1000,
+        'min': samples[0] * 1000,
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'max': samples[-1] * 1000,
+    }
+
+
+def measure(func, repeat, setup=None):  # Время каждого из repeat вызовов func, setup в замер не входит
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def free_tiles(map):
+    return [(i % map.width, i // map.width) for i, free in enumerate(map.passable) if free]
+
+
+def load_level(map_filename, enemy_count, rng):  # Чистая игра на карте и enemy_count дополнительных врагов
+    main.enemies.clear()
+    main.bullets.clear()
+    main.weapons[:] = ['pistol', 'shotgun']
+    main.kills = 0
+    main.win = main.lose = False
+    map = main.levels.get(map_filename)
+    map.spawn_enemies()
+    tiles = free_tiles(map)
+    for _ in range(enemy_count):
+        main.enemies.append(main.Enemy(rng.choice(tiles), 'enemy_cultist.png', main.enemy_hp))
+    hero = main.Hero(map.spawn_pos, 'hero.png', PLAYER_HP, 10 ** 9)
+    hero.weapon = 'pistol'
+    return main.Game(map, hero), tiles
+
+
+def spawn_bullets(count, tiles, rng):
+    main.bullets.clear()
+    for _ in range(count):
+        x, y = rng.choice(tiles)
+        target = rng.randrange(WINDOW_WIDTH), rng.randrange(WINDOW_HEIGHT)
+        main.bullets.fire(x * TILE_SIZE + TILE_SIZE // 2, y * TILE_SIZE + TILE_SIZE // 2, target)
+
+
+def bench_level(screen, map_filename, enemy_count, bullet_count, repeat, seed):
+    rng = random.Random(seed)
+    game, tiles = load_level(map_filename, enemy_count, rng)
+    hero_pos = game.hero.get_pos()
+    timings = {}
+
+    timings['map_render'] = measure(lambda: game.map.render(screen), repeat)
+
+    def reset_flow_field():
+        game.map.reset_flow_field()
+
+    def find_paths():  # Как в Game.step: поле путей в окне камеры, затем шаг каждого врага
+        game.map.update_flow_field(hero_pos, game.get_flow_bounds())
+        for enemy in main.enemies:
+            game.map.find_path_step(enemy.get_pos())
+
+    timings['find_path_step'] = measure(find_paths, repeat, reset_flow_field)
+
+    def find_crowd_paths():  # То же с занятостью тайлов (CrowdGrid), как в Game.move_enemy
+        occupied = game.crowd.counts
+        game.map.update_flow_field(hero_pos, game.get_flow_bounds())
+        for enemy in main.enemies:
+            game.map.find_path_step(enemy.get_pos(), occupied=occupied)
+
+    timings['find_path_step_crowd'] = measure(find_crowd_paths, repeat, reset_flow_field)
+
+    pixel_x, pixel_y = game.hero.get_pixel_pos()
+    timings['check_wall_for_player'] = measure(lambda: game.check_wall_for_player(pixel_x, pixel_y), repeat)
+
+    def prepare_bullets():
+        spawn_bullets(bullet_count, tiles, rng)
+        game.index_enemies()
+
+    timings['check_enemy_for_bullet'] = measure(game.check_enemy_for_bullet, repeat, prepare_bullets)
+
+    # Полный кадр: враги бегут к герою, пули летят. Герой и враги бессмертны, чтобы все кадры были одинаково
+    # нагружены: за тик враг получает не больше одной пули, а hp перед каждым кадром восстанавливается
+    inputs = main.Inputs(target=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
+    spawn_bullets(bullet_count, tiles, rng)
+    enemies_total = len(main.enemies)
+
+    def prepare_frame():
+        main.lose = False
+        main.enemies.hp[:] = array('i', [main.enemy_hp]) * len(main.enemies)
+        if len(main.bullets) < bullet_count // 2:
+            spawn_bullets(bullet_count, tiles, rng)
+
+    def frame():
+        game.step(inputs, TICK)
+        game.render(screen)
+
+    timings['frame'] = measure(frame, repeat, prepare_frame)
+    return {
+        'map': map_filename,
+        'enemies': enemy_count,  # Добавлено к врагам карты (--enemies)
+        'enemies_total': enemies_total,
+        'bullets': bullet_count,
+        'timings_ms': timings,
+    }
+
+
+def run(args):
+    main.verbose = False
+    screen = main.init_headless(WINDOW_SIZE)
+    results = []
+    for map_filename in args.maps:
+        for enemy_count in args.enemies:
+            for bullet_count in args.bullets:
+                results.append(bench_level(screen, map_filename, enemy_count, bullet_count, args.repeat, args.seed))
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Hot Rooms performance benchmark')
+    parser.add_argument('--maps', nargs='+', default=[f'map{n}.tmx' for n in range(1, MAPS_COUNT + 1)])
+    parser.add_argument('--enemies', nargs='+', type=int, default=[0, 50, 200],
+                        help='сколько врагов добавить к врагам карты')
+    parser.add_argument('--bullets', nargs='+', type=int, default=[0, 300, 1500])
+    parser.add_argument('--repeat', type=int, default=100, help='замеров на каждую метрику')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = run(args)
+    if args.output:
+        with open(args.output, mode='w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    pygame.quit()
@@ -0,0 +1,91 @@
+"""
+Снимки состояния игры. GameState собирает Game.snapshot: герой, враги и пули (копиями массивов EnemyRegistry
+и BulletPool), оружие, номер карты и счётчики. Game.restore возвращает игру в снимок за миллисекунды: карта
+берётся из LevelCache, TMX заново не разбирается. Снимок начала уровня лежит в Game.checkpoint.
+
+На диск снимок пишется по желанию (F5 - сохранить, F9 - загрузить в main.py): заголовок struct и массивы
+друг за другом, без упаковки и разбора по одному значению. Следом тем же форматом идёт снимок начала
+уровня, чтобы после загрузки R перезапускал именно тот уровень, на котором было сохранение.
+"""
+import os
+import struct
+from array import array
+from collections import namedtuple
+
+MAGIC = b'HRCP'
+VERSION = 2
+# magic, версия, карта, сложность, флаги (win, lose, прицел), оружие героя, подобранное оружие (номера слотов
+# в порядке подбора), убийства, время ИИ, герой x/y, hp, патроны, прицел x/y, врагов, пуль
+HEADER = struct.Struct('<4sHBBBB2sidddiiddII')
+DIFFICULTIES = ('Easy', 'Hard')
+WEAPONS = ('pistol', 'shotgun')  # Порядок слотов оружия
+ENEMY_COLUMNS = 'ddiddd'  # x, y, hp, цель x/y (nan - нет цели), время, когда видел героя
+BULLET_COLUMNS = 'dddddhB'  # x, y, dx, dy, скорость, угол, владелец
+
+# enemies - (x, y, hp, target_x, target_y, seen_at), bullets - (x, y, dx, dy, speed, angle, owner): массивы array
+GameState = namedtuple('GameState', ['map_number', 'difficulty', 'kills', 'weapons', 'win', 'lose', 'time',
+                                     'hero_pos', 'hero_hp', 'ammo', 'weapon', 'aiming', 'target',
+                                     'enemies', 'bullets'])
+
+
+def pack(state):  # Заголовок и столбцы одного снимка
+    flags = state.win | state.lose << 1 | state.aiming << 2
+    weapon = WEAPONS.index(state.weapon) + 1 if state.weapon else 0
+    picked = bytes(WEAPONS.index(name) + 1 for name in state.weapons)
+    header = HEADER.pack(MAGIC, VERSION, state.map_number, DIFFICULTIES.index(state.difficulty), flags, weapon,
+                         picked, state.kills, state.time, *state.hero_pos, state.hero_hp, state.ammo, *state.target,
+                         len(state.enemies[0]), len(state.bullets[0]))
+    return header + b''.join(array(typecode, column).tobytes()
+                             for column, typecode in zip(state.enemies + state.bullets, ENEMY_COLUMNS + BULLET_COLUMNS))
+
+
+def unpack(buffer, offset, path):  # Снимок из buffer начиная с offset и смещение за ним
+    if len(buffer) < offset + HEADER.size:
+        raise ValueError(f'{path}: not a Hot Rooms checkpoint')
+    magic, version, map_number, difficulty, flags, weapon, weapons, kills, time, hero_x, hero_y, hero_hp, ammo, \
+        target_x, target_y, enemy_count, bullet_count = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{path}: not a Hot Rooms checkpoint (version {VERSION})')
+    if difficulty >= len(DIFFICULTIES):
+        raise ValueError(f'{path}: unknown difficulty {difficulty}')
+    for slot in (weapon, *weapons):  # 0 - пустой слот
+        if slot > len(WEAPONS):
+            raise ValueError(f'{path}: unknown weapon {slot}')
+    columns = []
+    offset += HEADER.size
+    for typecode, count in [(code, enemy_count) for code in ENEMY_COLUMNS] + \
+                           [(code, bullet_count) for code in BULLET_COLUMNS]:
+        column = array(typecode)
+        size = column.itemsize * count
+        if offset + size > len(buffer):
+            raise ValueError(f'{path}: checkpoint is truncated')
+        column.frombytes(buffer[offset:offset + size])
+        columns.append(column)
+        offset += size
+    picked = tuple(WEAPONS[i - 1] for i in weapons if i)
+    state = GameState(map_number, DIFFICULTIES[difficulty], kills, picked, bool(flags & 1), bool(flags & 2), time,
+                      (hero_x, hero_y), hero_hp, ammo, WEAPONS[weapon - 1] if weapon else None, bool(flags & 4),
+                      (target_x, target_y), tuple(columns[:len(ENEMY_COLUMNS)]), tuple(columns[len(ENEMY_COLUMNS):]))
+    return state, offset
+
+
+def save(path, state, level_start=None):  # Записывает снимок (и снимок начала его уровня) атомарно: читатель
+    temp_path = f'{path}.{os.getpid()}.tmp'  # никогда не увидит половину файла
+    try:
+        with open(temp_path, mode='wb') as file:
+            file.write(pack(state))
+            if level_start is not None:
+                file.write(pack(level_start))
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load(path):  # (GameState, снимок начала уровня или None) из файла. ValueError, если это не снимок
+    with open(path, mode='rb') as file:  # или файл обрезан
+        buffer = file.read()
+    state, offset = unpack(buffer, 0, path)
+    level_start = unpack(buffer, offset, path)[0] if offset < len(buffer) else None
+    return state, level_start
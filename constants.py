@@ -1,32 +1,93 @@
 # Базовые константы
 WINDOW_SIZE = WINDOW_WIDTH, WINDOW_HEIGHT = 1920, 1080
 FPS = 60
+TICK = 1 / FPS  # Фиксированный шаг симуляции, секунды
+MAX_STEPS_PER_FRAME = 5
 MAPS_DIR = 'maps'
 SPRITES_DIR = 'sprites'
 TILE_SIZE = 25
 MOVE_SPEED = 2
-ENEMY_EVENT_TYPE = 30
-ENEMY_DELAY = 200
+ENEMY_DELAY = 200  # Мс на один тайл пути врага и период его "мышления"
+ENEMY_SPEED = TILE_SIZE / ENEMY_DELAY * 1000 / FPS  # Пикселей за тик
+AI_BUDGET_MS = 2.0  # Бюджет на мышление врагов за один тик
+AI_FAR_DISTANCE = 20  # Тайлов от героя, дальше враг думает реже
+AI_FAR_FACTOR = 4
 ENEMY_TRIGGER_SIZE = 25
+FLOW_FIELD_MARGIN = 8  # Тайлов поля путей за зоной бодрствования врагов: запас на обход стен
+FLOW_FIELD_TILES_PER_TICK = 1024  # Сколько тайлов поля путей достраивается за тик
+ENEMY_AGGRO_MEMORY = 2.0  # Секунд враг помнит героя после потери прямой видимости
+VISIBILITY_CACHE_SIZE = 1 << 16  # Пар тайлов в кэше видимости карты
 ENEMY_HP = 25
 PLAYER_HP = 25
 BULLET_SPEED = 20
+BULLET_SIZE = (10, 4)
+BULLET_HITBOX = 10
+BULLET_POOL_SIZE = 4096
+BULLET_NUMPY_MIN = 64  # С этого числа пуль BulletPool считает их массивами NumPy (если он установлен)
+OWNER_HERO = 0
+ENEMY_TEXTURE = 'enemy_cultist.png'
+CHECKPOINT_PATH = 'quicksave.hrc'  # Сохранение по F5, загрузка по F9 (см. checkpoint)
+ASSET_CACHE_SIZE = 512
+TEXT_CACHE_SIZE = 64  # Строк текста в кэше render_text
+ROTATION_STEP = 5
+# Манифест текстур для ленивой/фоновой загрузки: имя файла в SPRITES_DIR -> строить ли атлас поворотов
+ASSET_MANIFEST = {
+    'hero.png': True,
+    'enemy_cultist.png': False,
+    '1.png': False,
+    '2.png': False,
+    'pistol_clear.png': False,
+    'shotgun_clear.png': False,
+}
+HUD_MARGIN = (30, 200)  # Отступ HUD от правого и верхнего края экрана
+HUD_SIZE = (600, 500)
+SPATIAL_CELL_SIZE = TILE_SIZE * 2
+
+# Вывод на экран (см. display)
+FRAME_PACING = 'vsync'  # vsync, cap или uncapped; переопределяется ключом frame_pacing в config.ini
+DYNAMIC_RESOLUTION = True  # Ключ dynamic_resolution в config.ini
+RENDER_SCALE_MIN = 0.5  # Наименьшая доля логического разрешения
+RENDER_SCALE_STEP = 0.125
+RENDER_SCALE_WINDOW = 60  # Кадров, по которым решается смена масштаба
+RENDER_SCALE_HIGH = 0.9  # Доля бюджета кадра, выше которой разрешение снижается
+RENDER_SCALE_LOW = 0.6  # и ниже которой повышается
+
+# Сетевой режим (см. net)
+NET_HOST = '127.0.0.1'
+NET_PORT = 7777
+NET_SNAPSHOT_RATE = 20  # Снимков состояния в секунду на клиента
+NET_POSITION_SCALE = 4  # Позиции в снимках квантуются до 1/4 пикселя (uint16)
+NET_INTERP_SNAPSHOTS = 2  # На сколько интервалов между снимками клиент отстаёт от сервера ради интерполяции
+NET_SNAPSHOT_BUFFER = 32  # Снимков в буфере клиента
+NET_MAX_PENDING_BYTES = 256 * 1024  # Если клиент не успевает читать, снимки ему пропускаются
+NET_RESTART_DELAY = 3.0  # Секунд после победы или поражения до перезапуска серверной игры
+NET_STATS_EVERY = 5.0  # Секунд между строками статистики сервера
+
+# Профилирование кадров
+PROFILE_LOG = 'profile.jsonl'
+PROFILE_LOG_MAX_BYTES = 1024 * 1024
+PROFILE_WINDOW = 600  # Кадров в окне для p50/p95/p99
+PROFILE_SUMMARY_EVERY = 300
+LONG_FRAME_MS = 1000 / FPS * 1.5
+
+# ID тайлов, по которым можно ходить, и тайлов-триггеров
+FREE_TILES = [0, 8, 16, 13, 7, 15, 23]
+TRIGGER_TILES = [7, 8, 13, 23]
+MAPS_COUNT = 5
+LEVEL_CACHE_SIZE = 3
+
+# Камера и потоковая подгрузка карты
+MAP_CHUNK_TILES = 16  # Сторона чанка запечённого слоя карты в тайлах
+MAP_CHUNK_CACHE_SIZE = 64  # Сколько чанков держать в памяти, давно не видимые вытесняются
+ENEMY_WAKE_MARGIN = 10 * TILE_SIZE  # Враги дальше этого от края камеры спят: не думают, не двигаются
 
 PISTOL_DAMAGE = 5
 RIFLE_DAMAGE = 10
 SHOTGUN_DAMAGE = 15
 
-# Плейлист
-PLAYLIST = list()
-PLAYLIST.append("music/INTERWORLD_-_cold_bones_75298695.mp3")
-PLAYLIST.append("music/Lofiphonk.mp3")
-PLAYLIST.append("music/Ja Zae6alsja. — BERSERK PHONK (www.lightaudio.ru).mp3")
-PLAYLIST.append("music/Kildzho_shadowraze_-_Chronosphere_75359166.mp3")
-PLAYLIST.append("music/Kordhell_-_Fatality_74450624.mp3")
-PLAYLIST.append("music/Kordhell_-_Murder_In_My_Mind_73962603.mp3")
-PLAYLIST.append("music/KSLV_Noh_-_Disaster_74627719.mp3")
-PLAYLIST.append("music/RW77_ShadowBless_-_EVIL_PHONK_75352449.mp3")
-PLAYLIST.append("music/SLXSH, Florid - UNDERGROUND.mp3")
+# Музыка
+MUSIC_DIR = 'music'
+MUSIC_PREFETCH_MAX_BYTES = 16 * 1024 * 1024  # Треки крупнее играют потоково с диска
 
 # Константы с цветами
 BLACK, WHITE, RED = (0, 0, 0), (255, 255, 255), (255, 0, 0)
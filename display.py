@@ -0,0 +1,95 @@
+"""
+Вывод кадра на экран: окно с плавающим внутренним разрешением и режимы ограничения FPS.
+
+Логический размер кадра всегда WINDOW_SIZE: в нём живут камера, HUD и мышь. Реально кадр рисуется
+с масштабом scale в окно размером WINDOW_SIZE * scale, а растягивает его до экрана SDL (флаг SCALED,
+на видеокарте). Если кадры не укладываются в бюджет, scale снижается, если укладываются с запасом - растёт.
+"""
+from collections import deque
+
+import pygame
+
+from constants import *
+
+PACING_MODES = ('vsync', 'cap', 'uncapped')
+
+
+class FramePacer:
+    """
+    Класс FramePacer ограничивает частоту кадров. vsync - ждёт обратный ход луча во flip (если драйвер
+    его не дал, работает как cap), cap - clock.tick(fps), uncapped - без ожидания, для бенчмарков.
+    """
+
+    def __init__(self, mode=FRAME_PACING, fps=FPS):
+        if mode not in PACING_MODES:
+            raise ValueError(f'Unknown frame pacing {mode!r}, expected one of {PACING_MODES}')
+        self.mode = mode
+        self.fps = fps
+        self.vsync = mode == 'vsync'  # Сбрасывается, если окно с vsync открыть не удалось
+        self.clock = pygame.time.Clock()
+
+    def tick(self):  # Секунды с прошлого кадра
+        if self.mode == 'cap' or self.mode == 'vsync' and not self.vsync:
+            return self.clock.tick(self.fps) / 1000
+        return self.clock.tick() / 1000
+
+    def get_fps(self):
+        return self.clock.get_fps()
+
+
+class Display:
+    """
+    Класс Display открывает окно и подбирает внутреннее разрешение. Масштаб меняется шагами
+    RENDER_SCALE_STEP от RENDER_SCALE_MIN до 1: вниз, когда среднее время работы кадра за RENDER_SCALE_WINDOW
+    кадров выше RENDER_SCALE_HIGH от бюджета, вверх - когда ниже RENDER_SCALE_LOW. Если драйвер не умеет
+    SCALED, окно открывается в полном размере и масштаб не меняется.
+    """
+
+    def __init__(self, pacer, dynamic=DYNAMIC_RESOLUTION, fullscreen=True, size=WINDOW_SIZE):
+        self.pacer = pacer
+        self.dynamic = dynamic
+        self.size = size
+        self.flags = pygame.FULLSCREEN if fullscreen else 0
+        self.budget_ms = 1000 / pacer.fps
+        self.samples = deque(maxlen=RENDER_SCALE_WINDOW)
+        self.scale = 1.0
+        self.screen = self.open(1.0)
+
+    def open(self, scale):
+        size = (round(self.size[0] * scale), round(self.size[1] * scale))
+        if self.pacer.vsync:
+            try:
+                return pygame.display.set_mode(size, self.flags | pygame.SCALED, vsync=1)
+            except pygame.error as error:
+                print(f'VSync unavailable: {error}')
+                self.pacer.vsync = False
+        try:
+            return pygame.display.set_mode(size, self.flags | pygame.SCALED)
+        except pygame.error as error:
+            print(f'Dynamic resolution disabled: {error}')
+            self.dynamic = False
+            self.scale = 1.0
+            return pygame.display.set_mode(self.size, self.flags)
+
+    def set_scale(self, scale):  # True, если окно пересоздано и кадр надо перерисовать целиком
+        previous = self.scale
+        self.scale = scale
+        self.screen = self.open(scale)  # Если окно не открылось, open вернёт полный размер и scale = 1
+        self.samples.clear()
+        return self.scale != previous
+
+    def update(self, work_ms):  # work_ms - время кадра без ожидания vsync/таймера. True, если масштаб сменился
+        if not self.dynamic:
+            return False
+        self.samples.append(work_ms)
+        if len(self.samples) < self.samples.maxlen:
+            return False
+        mean = sum(self.samples) / len(self.samples)
+        if mean > self.budget_ms * RENDER_SCALE_HIGH and self.scale > RENDER_SCALE_MIN:
+            return self.set_scale(max(RENDER_SCALE_MIN, self.scale - RENDER_SCALE_STEP))
+        if mean < self.budget_ms * RENDER_SCALE_LOW and self.scale < 1:
+            return self.set_scale(min(1.0, self.scale + RENDER_SCALE_STEP))
+        return False
+
+    def to_logical(self, pos):  # Позиция мыши в окне -> координаты логического кадра WINDOW_SIZE
+        return round(pos[0] / self.scale), round(pos[1] / self.scale)
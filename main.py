@@ -1,38 +1,151 @@
+import os
 import math
+import time
+import heapq
+import random
+import weakref
 import configparser
-from random import choice
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')  # Приветствие pygame в stdout испортило бы JSON-отчёты
 import pygame
 import pytmx
 
+try:
+    import numpy
+except ImportError:  # NumPy не обязателен: без него пули считаются по одной (см. BulletPool.update)
+    numpy = None
+
+import checkpoint
+import mapcache
+from assets import AssetCache
+from audio import Playlist
 from constants import *
+from display import Display, FramePacer
+from profiler import FrameProfiler
 
 
 # Вспомогательные переменные для игры
 map_number = 1
 kills = 0
 weapons = []
-bullets = []
-enemies = []
 enemy_hp = ENEMY_HP
-enemy_event = False
 win = False
 lose = False
-pistol_image = pygame.image.load('sprites/pistol_clear.png')
-shotgun_image = pygame.image.load('sprites/shotgun_clear.png')
-one_image = pygame.image.load('sprites/1.png')
-two_image = pygame.image.load('sprites/2.png')
+assets = AssetCache()
+texts = AssetCache(TEXT_CACHE_SIZE)  # Отрисованные строки: счётчики вроде "Ammo: N" не вытесняют атлас поворотов
+profiler = FrameProfiler()
+fonts = {}
+scaled_surfaces = weakref.WeakKeyDictionary()  # Поверхность -> {масштаб: уменьшенная копия}
 
 # Вспомогательные настройки
 hex = False
 person_hitbox_view = False
 enemy_trigger_size_view = False
+verbose = True  # Печать игровых событий в консоль (в бенчмарках и симуляции выключается)
+dirty_rects = False  # Перерисовывать только изменившиеся области экрана (pygame.display.update(rects))
+
+# Конфигурация пользователя, читается в load_config при старте игры
+username = ''
+difficulty = 'Easy'
+frame_pacing = FRAME_PACING
+dynamic_resolution = DYNAMIC_RESOLUTION
+
+
+# Ввод игрока за один тик симуляции: направление движения (-1/0/1), точка прицеливания (экранная,
+# у сетевого ввода - на карте), выстрел и переключение прицела в этом тике, выбранный слот оружия (0 - без смены)
+Inputs = namedtuple('Inputs', ['dx', 'dy', 'target', 'shoot', 'aim', 'weapon'],
+                    defaults=(0, 0, (0, 0), False, False, 0))
+
+
+def load_config(path='config.ini'):
+    global username, frame_pacing, dynamic_resolution
+    config = configparser.ConfigParser()
+    config.read(path)
+    username = config['CONFIG']['username']
+    set_difficulty(config['CONFIG']['difficulty'])
+    frame_pacing = config['CONFIG'].get('frame_pacing', FRAME_PACING)  # Необязательные ключи
+    dynamic_resolution = config['CONFIG'].getboolean('dynamic_resolution', DYNAMIC_RESOLUTION)
+
+
+def set_difficulty(value):  # 'Easy' или 'Hard': на Hard у врагов вдвое больше hp
+    global difficulty, enemy_hp
+    difficulty = value
+    enemy_hp = ENEMY_HP * 2 if difficulty == 'Hard' else ENEMY_HP
+
+
+def init_pygame():  # pre_init микшера должен идти до pygame.init, поэтому инициализация в одном месте
+    pygame.mixer.pre_init(44100, -16, 1, 512)
+    pygame.init()
+
+
+def preload():  # Фоновая подготовка первой карты и текстур, пока показывается меню
+    levels.prefetch(f'map{map_number}.tmx')
+    assets.preload_async(ASSET_MANIFEST)
+
+
+def init_headless(size=(1, 1)):  # pygame без окна и звука (SDL dummy) для симуляции, тестов и бенчмарков
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pygame.init()
+    return pygame.display.set_mode(size)
 
-# Конфигурация пользователя
-config = configparser.ConfigParser()
-config.read('config.ini')
-username = config['CONFIG']['username']
-difficulty = config['CONFIG']['difficulty']
+
+def read_inputs(events, display=None):  # Собирает Inputs из событий pygame и состояния клавиатуры/мыши.
+    key = pygame.key.get_pressed()
+    dx = (key[pygame.K_d] or key[pygame.K_RIGHT]) - (key[pygame.K_a] or key[pygame.K_LEFT])
+    dy = (key[pygame.K_s] or key[pygame.K_DOWN]) - (key[pygame.K_w] or key[pygame.K_UP])
+    shoot = aim = False
+    for event in events:
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 1:
+                shoot = True
+            if event.button == 3:
+                aim = True
+    weapon = 1 if key[pygame.K_1] else 2 if key[pygame.K_2] else 0
+    target = pygame.mouse.get_pos()
+    if display is not None:  # Окно с внутренним разрешением (см. display): в логические координаты
+        target = display.to_logical(target)
+    return Inputs(dx, dy, target, shoot, aim, weapon)
+
+
+def log(*args):
+    if verbose:
+        print(*args)
+
+
+def get_font(size):  # Шрифты создаются один раз на размер
+    font = fonts.get(size)
+    if font is None:
+        font = fonts[size] = pygame.font.Font(None, size)
+        profiler.count('fonts_built')
+    return font
+
+
+def render_text(text, size, color):  # Поверхность текста из своего кэша, рендерится один раз на значение
+    return texts.get((text, size, color), lambda: get_font(size).render(text, True, color))
+
+
+def scale_surface(surface, scale):  # Копия поверхности для кадра с внутренним разрешением scale (см. display).
+    if scale == 1:                   # Строится один раз и живёт, пока жив оригинал
+        return surface
+    variants = scaled_surfaces.get(surface)
+    if variants is None:
+        variants = scaled_surfaces[surface] = {}
+    result = variants.get(scale)
+    if result is None:
+        width, height = surface.get_size()
+        result = variants[scale] = pygame.transform.scale(
+            surface, (max(1, round(width * scale)), max(1, round(height * scale))))
+        profiler.count('surfaces_scaled')
+    return result
+
+
+def scale_rect(rect, offset, scale):  # Прямоугольник в координатах карты -> прямоугольник на кадре
+    return pygame.Rect(round((rect[0] - offset[0]) * scale), round((rect[1] - offset[1]) * scale),
+                       max(1, round(rect[2] * scale)), max(1, round(rect[3] * scale)))
 
 
 class Map:
@@ -42,102 +155,413 @@ class Map:
     TODO: Переделать описание класса да и ваще всего кода
 
     Так-же в инициализатор передается список ID тайлов, по которым можно ходить и тайлы-триггеры.
+    Если рядом с TMX есть свежий бинарный кэш (см. mapcache), карта читается из него, и pytmx не нужен.
+    Слой тайлов запекается из атласа картинок тайлов чанками по MAP_CHUNK_TILES тайлов, когда они попадают
+    в камеру, в памяти держится не больше MAP_CHUNK_CACHE_SIZE чанков.
     """
 
     def __init__(self, map_filename, free_tiles, trigger_tiles):
-        self.map = pytmx.load_pygame(f'{MAPS_DIR}/{map_filename}')
+        self.path = f'{MAPS_DIR}/{map_filename}'
         self.spawn_pos = (1, 1)
-        self.height = self.map.height
-        self.width = self.map.width
         self.free_tiles = free_tiles
         self.trigger_tiles = trigger_tiles
-        self.spawn_enemies()
+        self.flow_field = None  # Готовое поле путей врагов (FlowField)
+        self.flow_pending = None  # Поле, которое достраивается по тикам
+        self.enemy_spawns = []
+        self.map = None
+        self.cells = None  # Номер картинки атласа для каждой клетки слоя, 0 - пустая клетка
+        self.atlas = None  # Картинки тайлов слоя в одну строку, первая - пустая клетка
+        self.chunks = OrderedDict()  # Индекс чанка -> запечённая поверхность
+        self.visibility = {}  # Пара индексов тайлов -> видны ли они друг другу
+        if not self.load_cache():
+            self.map = pytmx.load_pygame(self.path)
+            self.height = self.map.height
+            self.width = self.map.width
+            self.decode_layer()
+            self.find_spawns()
+            self.chunk_rects = mapcache.get_chunk_rects(self.width, self.height)
+            mapcache.save(self.path, free_tiles, trigger_tiles, self)
+        self.pixel_size = (self.width * TILE_SIZE, self.height * TILE_SIZE)
+        self.chunk_columns = -(-self.width // MAP_CHUNK_TILES)
+        self.grid_surface = self.bake_grid()
+
+    def load_cache(self):  # Загрузка из бинарного кэша, False если кэша нет или он устарел
+        data = mapcache.load(self.path, self.free_tiles, self.trigger_tiles)
+        if data is None:
+            return False
+        self.width, self.height = data.width, data.height
+        self.spawn_pos = data.spawn_pos
+        self.enemy_spawns = data.enemy_spawns
+        self.tiles, self.passable, self.triggers = data.tiles, data.passable, data.triggers
+        self.cells, self.atlas = data.cells, data.atlas.convert()
+        self.chunk_rects = mapcache.get_chunk_rects(self.width, self.height)
+        return True
 
-    def render(self, screen):  # Отрисовка карты на холсте
+    def bake_chunk(self, index):  # Поверхность чанка из картинок атласа
+        rect = self.chunk_rects[index]
+        surface = pygame.Surface(rect.size)
+        atlas, cells, width = self.atlas, self.cells, self.width
+        area = pygame.Rect(0, 0, TILE_SIZE, TILE_SIZE)
+        for y in range(rect.top // TILE_SIZE, rect.bottom // TILE_SIZE):
+            for x in range(rect.left // TILE_SIZE, rect.right // TILE_SIZE):
+                cell = cells[y * width + x]
+                if cell:
+                    area.x = cell * TILE_SIZE
+                    surface.blit(atlas, (x * TILE_SIZE - rect.x, y * TILE_SIZE - rect.y), area)
+        return surface
+
+    def get_chunk(self, index):  # Запечённый чанк, давно не использованные вытесняются
+        surface = self.chunks.get(index)
+        if surface is None:
+            surface = self.chunks[index] = self.bake_chunk(index)
+            profiler.count('chunks_baked')
+            while len(self.chunks) > MAP_CHUNK_CACHE_SIZE:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(index)
+        return surface
+
+    def get_chunks(self, view):  # Индексы чанков, пересекающих область view (пиксели карты)
+        step = MAP_CHUNK_TILES * TILE_SIZE
+        left, top = max(view.left, 0) // step, max(view.top, 0) // step
+        right = min(view.right, self.pixel_size[0]) - 1
+        bottom = min(view.bottom, self.pixel_size[1]) - 1
+        return [y * self.chunk_columns + x
+                for y in range(top, bottom // step + 1)
+                for x in range(left, right // step + 1)]
+
+    def stream(self, view):  # Заранее запекает один недостающий чанк вокруг view, чтобы камера не ждала
+        step = MAP_CHUNK_TILES * TILE_SIZE
+        for index in self.get_chunks(view.inflate(step * 2, step * 2)):
+            if index not in self.chunks:
+                self.get_chunk(index)
+                return
+
+    def bake_grid(self):  # Белая сетка (hex) на один чанк отдельным прозрачным слоем
+        size = MAP_CHUNK_TILES * TILE_SIZE
+        surface = pygame.Surface((size, size), pygame.SRCALPHA)
+        for y in range(MAP_CHUNK_TILES):
+            for x in range(MAP_CHUNK_TILES):
+                rect = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+                pygame.draw.rect(surface, WHITE, rect, 1)
+        return surface
+
+    # Рисует видимые чанки. offset - позиция камеры, area - область кадра, которую надо закрасить,
+    # scale - масштаб внутреннего разрешения
+    def render(self, screen, offset=(0, 0), area=None, scale=1.0):
+        area = screen.get_rect() if area is None else area
+        view = pygame.Rect(offset[0] + area.x / scale, offset[1] + area.y / scale,
+                           area.width / scale + 1, area.height / scale + 1)
+        for index in self.get_chunks(view):
+            rect = self.chunk_rects[index]
+            surface = scale_surface(self.get_chunk(index), scale)
+            pos = (round((rect.x - offset[0]) * scale), round((rect.y - offset[1]) * scale))
+            clip = area.clip(pygame.Rect(pos, surface.get_size()))
+            source = clip.move(-pos[0], -pos[1])
+            screen.blit(surface, clip, source)
+            if hex:  # Белая сетка
+                screen.blit(scale_surface(self.grid_surface, scale), clip, source)
+
+    def decode_layer(self):  # Один раз переводит слой pytmx в плоские массивы: ID тайлов, маски проходимости/
+        self.tiles = array('h', [-1]) * (self.width * self.height)  # триггеров и клетки атласа
+        self.passable = bytearray(self.width * self.height)
+        self.triggers = bytearray(self.width * self.height)
+        self.cells = array('H', [0]) * (self.width * self.height)
+        free_tiles, trigger_tiles = set(self.free_tiles), set(self.trigger_tiles)
+        atlas_cells = {}  # gid pytmx -> номер картинки в атласе (повёрнутые тайлы - отдельные gid)
         for y in range(self.height):
             for x in range(self.width):
-                image = self.map.get_tile_image(x, y, 0)
-                screen.blit(image, (x * TILE_SIZE, y * TILE_SIZE))
-                if hex:  # Белая сетка
-                    rect = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                    pygame.draw.rect(screen, WHITE, rect, 1)
+                i = y * self.width + x
+                gid = self.map.get_tile_gid(x, y, 0)
+                tile_id = self.map.tiledgidmap[gid] - 1 if gid else -1
+                self.tiles[i] = tile_id
+                self.passable[i] = tile_id in free_tiles
+                self.triggers[i] = tile_id in trigger_tiles
+                if gid and self.map.get_tile_image_by_gid(gid):
+                    self.cells[i] = atlas_cells.setdefault(gid, len(atlas_cells) + 1)
+        self.atlas = pygame.Surface(((len(atlas_cells) + 1) * TILE_SIZE, TILE_SIZE))
+        for gid, cell in atlas_cells.items():
+            self.atlas.blit(self.map.get_tile_image_by_gid(gid), (cell * TILE_SIZE, 0))
+
+    def get_index(self, pos):  # Индекс тайла (x, y) в плоских массивах, координаты прижимаются к краям карты
+        x = min(max(pos[0], 0), self.width - 1)
+        y = min(max(pos[1], 0), self.height - 1)
+        return y * self.width + x
 
     def get_tile_id(self, pos):  # Возвращает ID тайла по координатам (x, y). Помогает понять его тип
-        pos_list = list(pos)
-        if pos[0] < 0:
-            pos_list[0] = 0
-        elif pos[0] > 49:
-            pos_list[0] = 49
-        if pos[1] > 34:
-            pos_list[1] = 34
-        elif pos[1] < 0:
-            pos_list[1] = 0
-        return self.map.tiledgidmap[self.map.get_tile_gid(*pos_list, 0)] - 1
+        return self.tiles[self.get_index(pos)]
 
     def get_tile_coords(self, pos):  # Возвращает пиксельные координаты тайла
         return pos[0] * TILE_SIZE, pos[1] * TILE_SIZE
 
-    def spawn_enemies(self):          # Спавнит врагов на тайлах спавна мобов. Все объекты создаются в списке enemies,
-        for y in range(self.height):  # там они рендерятся и обновляются.
-            for x in range(self.width):
-                if self.get_tile_id((x, y)) == 16:
-                    enemies.append(Enemy((x, y), 'enemy_cultist.png', enemy_hp))
-                elif self.get_tile_id((x, y)) == 15:
-                    self.spawn_pos = (x, y)
+    def find_spawns(self):  # Находит точку появления героя и тайлы спавна мобов
+        for i, tile_id in enumerate(self.tiles):
+            if tile_id == 16:
+                self.enemy_spawns.append((i % self.width, i // self.width))
+            elif tile_id == 15:
+                self.spawn_pos = (i % self.width, i // self.width)
 
-    def is_free(self, pos):  # Проверка на проходимость тайла
-        return self.get_tile_id(pos) in self.free_tiles
+    def spawn_enemies(self):  # Спавнит врагов на тайлах спавна мобов. Все объекты создаются в списке enemies,
+        for pos in self.enemy_spawns:  # там они рендерятся и обновляются.
+            enemies.append(Enemy(pos, ENEMY_TEXTURE, enemy_hp))
 
-    def find_path_step(self, start, target):  # Алгоритм поиска кратчайшего пути из тайла start в тайл target.
-        INF = 1000                            # Применяется для объектов врага
-        x, y = start
-        distance = [[INF] * self.width for _ in range(self.height)]
-        distance[y][x] = 0
-        prev = [[None] * self.width for _ in range(self.height)]
-        queue = [(x, y)]
-        while queue:
-            x, y = queue.pop(0)
-            for dx, dy in (0, 1), (1, 0), (-1, 0), (0, -1):
-                next_x, next_y = x + dx, y + dy
-                if 0 < next_x < self.width and 0 < next_y < self.height and \
-                        self.is_free((next_x, next_y)) and distance[next_y][next_x] == INF:
-                    distance[next_y][next_x] = distance[y][x] + 1
-                    prev[next_y][next_x] = (x, y)
-                    queue.append((next_x, next_y))
-        x, y = target
-        if distance[y][x] == INF or start == target:
+    def is_free(self, pos):  # Проверка на проходимость тайла
+        return self.passable[self.get_index(pos)] == 1
+
+    def is_trigger(self, pos):  # Проверка, является ли тайл триггером
+        return self.triggers[self.get_index(pos)] == 1
+
+    # DDA по тайлам: доля отрезка (0..1) до первого непроходимого тайла или None, если отрезок свободен.
+    # Край карты считается стеной
+    def cast_ray(self, x0, y0, x1, y1):
+        width, height, passable = self.width, self.height, self.passable
+        tile_x, tile_y = int(x0 // TILE_SIZE), int(y0 // TILE_SIZE)
+        end_x, end_y = int(x1 // TILE_SIZE), int(y1 // TILE_SIZE)
+        dx, dy = x1 - x0, y1 - y0
+        step_x, step_y = (1 if dx > 0 else -1), (1 if dy > 0 else -1)
+        if dx:
+            delta_x = TILE_SIZE / abs(dx)
+            next_x = ((tile_x + (step_x > 0)) * TILE_SIZE - x0) / dx
+        else:
+            delta_x = next_x = math.inf
+        if dy:
+            delta_y = TILE_SIZE / abs(dy)
+            next_y = ((tile_y + (step_y > 0)) * TILE_SIZE - y0) / dy
+        else:
+            delta_y = next_y = math.inf
+        t = 0.0
+        while True:
+            if not (0 <= tile_x < width and 0 <= tile_y < height) or not passable[tile_y * width + tile_x]:
+                return t
+            if tile_x == end_x and tile_y == end_y:
+                return None
+            if next_x < next_y:
+                t, tile_x, next_x = next_x, tile_x + step_x, next_x + delta_x
+            else:
+                t, tile_y, next_y = next_y, tile_y + step_y, next_y + delta_y
+            if t > 1:
+                return None
+
+    # cast_ray сразу для массивов NumPy отрезков: те же доли до стены, nan - отрезок свободен. Шаг DDA делается
+    # для всех лучей разом, пока не закончится самый длинный
+    def cast_rays(self, x0, y0, x1, y1):
+        width, height = self.width, self.height
+        passable = numpy.frombuffer(self.passable, dtype=numpy.uint8)
+        tile_x = numpy.floor_divide(x0, TILE_SIZE).astype(numpy.int64)
+        tile_y = numpy.floor_divide(y0, TILE_SIZE).astype(numpy.int64)
+        end_x = numpy.floor_divide(x1, TILE_SIZE).astype(numpy.int64)
+        end_y = numpy.floor_divide(y1, TILE_SIZE).astype(numpy.int64)
+        dx, dy = x1 - x0, y1 - y0
+        step_x, step_y = numpy.where(dx > 0, 1, -1), numpy.where(dy > 0, 1, -1)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            delta_x = numpy.where(dx != 0, TILE_SIZE / numpy.abs(dx), numpy.inf)
+            next_x = numpy.where(dx != 0, ((tile_x + (step_x > 0)) * TILE_SIZE - x0) / dx, numpy.inf)
+            delta_y = numpy.where(dy != 0, TILE_SIZE / numpy.abs(dy), numpy.inf)
+            next_y = numpy.where(dy != 0, ((tile_y + (step_y > 0)) * TILE_SIZE - y0) / dy, numpy.inf)
+        t = numpy.zeros(len(x0))
+        walls = numpy.full(len(x0), numpy.nan)
+        pending = numpy.ones(len(x0), dtype=bool)
+        while True:
+            inside = (tile_x >= 0) & (tile_x < width) & (tile_y >= 0) & (tile_y < height)
+            blocked = pending & ~(inside & (passable[numpy.where(inside, tile_y * width + tile_x, 0)] != 0))
+            walls[blocked] = t[blocked]
+            pending &= ~blocked & ((tile_x != end_x) | (tile_y != end_y))
+            if not pending.any():
+                return walls
+            along_x = next_x < next_y
+            t = numpy.where(along_x, next_x, next_y)
+            tile_x = numpy.where(along_x, tile_x + step_x, tile_x)
+            next_x = numpy.where(along_x, next_x + delta_x, next_x)
+            tile_y = numpy.where(along_x, tile_y, tile_y + step_y)
+            next_y = numpy.where(along_x, next_y, next_y + delta_y)
+            pending &= t <= 1
+
+    def has_line_of_sight(self, a, b):  # Видны ли друг другу центры тайлов a и b. Ответы кэшируются на карту
+        i, j = self.get_index(a), self.get_index(b)
+        key = (i, j) if i < j else (j, i)
+        visible = self.visibility.get(key)
+        if visible is None:
+            if len(self.visibility) >= VISIBILITY_CACHE_SIZE:
+                self.visibility.clear()
+            half = TILE_SIZE / 2
+            visible = self.visibility[key] = self.cast_ray(a[0] * TILE_SIZE + half, a[1] * TILE_SIZE + half,
+                                                           b[0] * TILE_SIZE + half, b[1] * TILE_SIZE + half) is None
+            profiler.count('los_rays')
+        return visible
+
+    # Достраивает поле путей до target в окне bounds (Rect в тайлах, None - вся карта), обходя за вызов
+    # не больше limit тайлов
+    def update_flow_field(self, target, bounds=None, limit=None):
+        if bounds is None:
+            bounds = pygame.Rect(0, 0, self.width, self.height)
+        pending = self.flow_pending
+        if pending is None:
+            field = self.flow_field
+            if field is not None and field.target == target and field.bounds == bounds:
+                return
+            pending = self.flow_pending = FlowField(self, target, bounds)
+        # Пока новое поле строится, враги ходят по предыдущему. Начатое поле достраивается, даже если герой уже
+        # ушёл с target, иначе при быстром движении оно не было бы готово никогда. Первое поле строится сразу
+        if pending.build(limit if self.flow_field is not None else None):
+            self.flow_field, self.flow_pending = pending, None
+
+    def reset_flow_field(self):
+        self.flow_field = self.flow_pending = None
+
+    # Следующий тайл кратчайшего пути из start для объектов врага, поле читается за O(1). occupied - занятость
+    # тайлов (CrowdGrid.counts): занятые тайлы пропускаются, а если все шаги к цели заняты, враг расходится
+    # с толпой на тайл той же дальности, у которого занятых соседей меньше, чем у текущего. Если враг делит тайл
+    # с другими, годится любой свободный соседний. Тайлы вне окна поля недостижимы
+    def find_path_step(self, start, target=None, occupied=None):
+        if target is not None and (self.flow_field is None or self.flow_field.target != target):
+            self.reset_flow_field()  # Путь вне Game.step (бенчмарки): поле по всей карте до target сразу
+            self.update_flow_field(target)
+        field = self.flow_field
+        if field is None or start == field.target:
             return start
-        while prev[y][x] != start:
-            x, y = prev[y][x]
-        return x, y
+        left, top, field_width, field_height = field.bounds
+        right, bottom, distance = left + field_width, top + field_height, field.distance
+        width = self.width
+        x, y = start
+        best, best_distance = start, None
+        if left <= x < right and top <= y < bottom and distance[(y - top) * field_width + x - left] != -1:
+            best_distance = distance[(y - top) * field_width + x - left]
+        current_distance = best_distance
+        side, side_crowd, shared = None, None, False
+        if occupied is not None and current_distance is not None:
+            side_crowd = self.count_crowd(occupied, x, y)
+            shared = occupied[y * width + x] > 1
+            if shared:
+                side_crowd = 5  # Больше любого числа соседей: подойдёт любой свободный тайл
+        for dx, dy in (0, 1), (1, 0), (-1, 0), (0, -1):
+            next_x, next_y = x + dx, y + dy
+            if left <= next_x < right and top <= next_y < bottom:
+                next_distance = distance[(next_y - top) * field_width + next_x - left]
+                if next_distance == -1 or occupied is not None and occupied[next_y * width + next_x]:
+                    continue
+                if best_distance is None or next_distance < best_distance:
+                    best, best_distance = (next_x, next_y), next_distance
+                elif (shared or next_distance == current_distance) and side_crowd:
+                    crowd = self.count_crowd(occupied, next_x, next_y) - 1  # Без самого идущего врага
+                    if crowd < side_crowd:
+                        side, side_crowd = (next_x, next_y), crowd
+        if best == start and side is not None:
+            return side
+        return best
+
+    def count_crowd(self, occupied, x, y):  # Занятых соседних тайлов (по четырём сторонам)
+        width, height, crowd = self.width, self.height, 0
+        for next_x, next_y in (x, y + 1), (x + 1, y), (x - 1, y), (x, y - 1):
+            if 0 <= next_x < width and 0 <= next_y < height and occupied[next_y * width + next_x]:
+                crowd += 1
+        return crowd
+
+
+class FlowField:
+    """
+    Класс FlowField - поле расстояний от тайлов окна bounds до тайла target (обратный BFS), одно на всех врагов.
+    В игре окно - зона бодрствования камеры с запасом FLOW_FIELD_MARGIN тайлов, поэтому цена поля зависит
+    от размера экрана, а не карты. Обход можно вести порциями по тикам (build с limit).
+    """
+    __slots__ = ('target', 'bounds', 'distance', 'passable', 'map_width', 'queue')
+
+    def __init__(self, map, target, bounds):
+        self.target = target
+        self.bounds = bounds
+        self.distance = array('i', [-1]) * (bounds.width * bounds.height)
+        self.passable = map.passable
+        self.map_width = map.width
+        self.queue = deque()
+        if bounds.collidepoint(target):
+            i = (target[1] - bounds.top) * bounds.width + target[0] - bounds.left
+            self.distance[i] = 0
+            self.queue.append(i)
+
+    def build(self, limit=None):  # Обходит не больше limit тайлов (None - до конца), True - поле готово
+        left, top, width, height = self.bounds
+        distance, passable, queue, map_width = self.distance, self.passable, self.queue, self.map_width
+        size = width * height
+        visited = 0
+        while queue and visited != limit:
+            i = queue.popleft()
+            visited += 1
+            x = i % width
+            tile = (top + i // width) * map_width + left + x  # Индекс того же тайла на всей карте
+            next_distance = distance[i] + 1
+            for j, next_tile, inside in (i + width, tile + map_width, i + width < size), \
+                    (i + 1, tile + 1, x + 1 < width), (i - 1, tile - 1, x > 0), \
+                    (i - width, tile - map_width, i >= width):
+                if inside and distance[j] == -1 and passable[next_tile]:
+                    distance[j] = next_distance
+                    queue.append(j)
+        profiler.count('flow_tiles', visited)
+        return not queue
+
+
+class LevelCache:
+    """
+    Класс LevelCache готовит карты (разбор TMX, маски тайлов, запечённый слой) в фоновом потоке и хранит
+    готовые объекты Map. Смена карты забирает уже готовый уровень, повторный заход на карту бесплатен.
+    Хранится не больше max_size уровней, давно не использованные вытесняются.
+    """
+
+    def __init__(self, max_size=LEVEL_CACHE_SIZE):
+        self.max_size = max_size
+        self.levels = OrderedDict()  # Имя файла -> Future с объектом Map
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='level-loader')
+
+    def prefetch(self, map_filename):  # Ставит карту в очередь на подготовку, если такой файл есть
+        future = self.levels.get(map_filename)
+        if future is None:
+            if not os.path.exists(f'{MAPS_DIR}/{map_filename}'):
+                return None
+            future = self.levels[map_filename] = self.executor.submit(Map, map_filename, FREE_TILES, TRIGGER_TILES)
+            while len(self.levels) > self.max_size:
+                self.levels.popitem(last=False)
+        return future
+
+    def get(self, map_filename):  # Готовая карта. Если фоновая подготовка ещё идёт, ждёт её окончания
+        future = self.prefetch(map_filename)
+        if future is None:
+            raise FileNotFoundError(f'{MAPS_DIR}/{map_filename}')
+        self.levels.move_to_end(map_filename)
+        try:
+            return future.result()
+        except Exception:
+            del self.levels[map_filename]  # Не кэшируем неудачную загрузку
+            raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+levels = LevelCache()
 
 
 class Person:
     """
     Класс Person создаёт сущностей на карте. При инициализации прописывается начальная точка появления
-    и текстуру
+    и текстуру. Где хранятся pixel_pos и hp, решают наследники (слоты у героя, массивы EnemyRegistry у врагов).
     """
+    __slots__ = ('texture_image',)
 
     def __init__(self, pos, texture, hp):
-        self.person_texture = pygame.sprite.Sprite()
-        self.person_texture.image = pygame.image.load(f'{SPRITES_DIR}/{texture}')
-        self.person_texture.rect = self.person_texture.image.get_rect()
-        self.x, self.y = pos
+        self.texture_image = assets.load(texture)
         self.pixel_pos = (pos[0] * TILE_SIZE, pos[1] * TILE_SIZE)
-        self.hitbox = pygame.Rect(self.x * TILE_SIZE, self.y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
         self.hp = hp
 
+    @property
+    def hitbox(self):  # Нужен только для отладочной отрисовки, поэтому не хранится
+        return self.get_rect()
+
     def get_pos(self):
         return round(self.pixel_pos[0] / TILE_SIZE), round(self.pixel_pos[1] / TILE_SIZE)
 
     def set_pos(self, pos):
-        self.x, self.y = pos[0], pos[1]
-        self.set_pixel_pos((self.x * TILE_SIZE, self.y * TILE_SIZE))
-        self.hitbox = pygame.Rect(*self.pixel_pos, TILE_SIZE, TILE_SIZE)
+        self.set_pixel_pos((pos[0] * TILE_SIZE, pos[1] * TILE_SIZE))
 
     def set_pixel_pos(self, pixel_pos):
-        self.pixel_pos = pixel_pos
-        self.hitbox = pygame.Rect(*self.pixel_pos, TILE_SIZE, TILE_SIZE)
+        self.pixel_pos = (pixel_pos[0], pixel_pos[1])
 
     def get_pixel_pos(self):
         return self.pixel_pos
@@ -145,215 +569,914 @@ class Person:
     def get_rect(self):
         return pygame.Rect(*self.pixel_pos, TILE_SIZE, TILE_SIZE)
 
-    def render(self, screen):  # Отрисовка существа на холсте
-        screen.blit(self.person_texture.image, self.pixel_pos)
+    # Отрисовка существа на холсте со сдвигом камеры offset, возвращает занятую область
+    def render(self, screen, offset=(0, 0), scale=1.0):
+        x, y = (self.pixel_pos[0] - offset[0]) * scale, (self.pixel_pos[1] - offset[1]) * scale
+        rect = screen.blit(scale_surface(self.texture_image, scale), (x, y))
         if person_hitbox_view:  # Hitbox существа
-            pygame.draw.rect(screen, GREEN, self.hitbox, 1)
+            rect.union_ip(pygame.draw.rect(screen, GREEN, scale_rect(self.hitbox, offset, scale), 1))
+        return rect
 
 
-class Enemy(Person):  # TODO: пофиксить стак врагов в одном тайле
+class Enemy(Person):
+    """
+    Враг. Пока он не добавлен в EnemyRegistry, позиция и hp хранятся в самом объекте, после добавления -
+    в массивах реестра по индексу slot. tile - индекс тайла, который враг занимает в CrowdGrid.
+    """
+    __slots__ = ('registry', 'slot', 'handle', 'own_pixel_pos', 'own_hp', 'triggering', 'alive', 'target_pos',
+                 'think_at', 'think_token', 'trigger_rect', 'seen_at', 'tile')
 
     def __init__(self, pos, texture, hp):
+        self.registry = None
+        self.slot = -1
+        self.handle = -1
         super().__init__(pos, texture, hp)
         self.triggering = False
+        self.alive = True
+        self.target_pos = None  # Пиксельная позиция следующего тайла пути
+        self.think_at = 0  # Время следующего выбора тайла (см. EnemyScheduler)
+        self.think_token = 0
+        self.seen_at = -math.inf  # Время (EnemyScheduler.time), когда враг последний раз видел героя
+        self.tile = -1
         self.trigger_rect = self.get_rect()
         self.trigger_rect.height = self.trigger_rect.width = ENEMY_TRIGGER_SIZE * TILE_SIZE
         self.trigger_rect.center = (self.pixel_pos[0] + TILE_SIZE // 2, self.pixel_pos[1] + TILE_SIZE // 2)
 
-    def render(self, screen):
-        super(Enemy, self).render(screen)
-        rect = pygame.Rect(self.pixel_pos[0], self.pixel_pos[1] - 6, self.hp, 5)
+    @property
+    def pixel_pos(self):
+        if self.registry is None:
+            return self.own_pixel_pos
+        return self.registry.x[self.slot], self.registry.y[self.slot]
+
+    @pixel_pos.setter
+    def pixel_pos(self, pixel_pos):
+        if self.registry is None:
+            self.own_pixel_pos = (pixel_pos[0], pixel_pos[1])
+        else:
+            self.registry.x[self.slot], self.registry.y[self.slot] = pixel_pos[0], pixel_pos[1]
+
+    @property
+    def hp(self):
+        if self.registry is None:
+            return self.own_hp
+        return self.registry.hp[self.slot]
+
+    @hp.setter
+    def hp(self, hp):
+        if self.registry is None:
+            self.own_hp = hp
+        else:
+            self.registry.hp[self.slot] = hp
+
+    def set_pixel_pos(self, pixel_pos):
+        self.pixel_pos = pixel_pos
+
+    def render(self, screen, offset=(0, 0), scale=1.0):
+        dirty = super(Enemy, self).render(screen, offset, scale)
+        x, y = self.pixel_pos
+        rect = (x, y - 6, self.hp, 5)
         if difficulty == 'Easy':
-            rect = pygame.Rect(self.pixel_pos[0], self.pixel_pos[1] - 6, self.hp, 5)
+            rect = (x, y - 6, self.hp, 5)
         elif difficulty == 'Hard':
-            rect = pygame.Rect(self.pixel_pos[0], self.pixel_pos[1] - 6, self.hp // 2, 5)
-        pygame.draw.rect(screen, RED, pygame.Rect(self.pixel_pos[0], self.pixel_pos[1] - 6, ENEMY_HP, 5))
-        pygame.draw.rect(screen, GREEN, rect)
+            rect = (x, y - 6, self.hp // 2, 5)
+        hp_rect = scale_rect((x, y - 6, ENEMY_HP, 5), offset, scale)
+        dirty.union_ip(pygame.draw.rect(screen, RED, hp_rect))
+        if rect[2] > 0:
+            pygame.draw.rect(screen, GREEN, scale_rect(rect, offset, scale))
         if enemy_trigger_size_view:
-            pygame.draw.rect(screen, RED, self.trigger_rect, 1)
+            dirty.union_ip(pygame.draw.rect(screen, RED, scale_rect(self.trigger_rect, offset, scale), 1))
+        return dirty
 
     def trigger_hero(self):
         self.trigger_rect.center = (self.pixel_pos[0] + TILE_SIZE // 2, self.pixel_pos[1] + TILE_SIZE // 2)
 
+    def advance(self, speed):  # Плавное движение к target_pos, возвращает True в момент прибытия
+        registry, slot = self.registry, self.slot
+        x, y = registry.x[slot], registry.y[slot]
+        target_x, target_y = self.target_pos
+        x += max(-speed, min(speed, target_x - x))
+        y += max(-speed, min(speed, target_y - y))
+        registry.x[slot], registry.y[slot] = x, y
+        self.trigger_rect.center = (x + TILE_SIZE // 2, y + TILE_SIZE // 2)
+        if x == target_x and y == target_y:
+            self.target_pos = None
+            return True
+        return False
+
+
+class EnemyRegistry:
+    """
+    Класс EnemyRegistry хранит врагов: позиции и hp лежат в плотных параллельных массивах x, y, hp,
+    а objects[i] - объект врага со slot == i. Удаление переносит последнего врага на место удалённого (O(1)),
+    handle врага при этом не меняется и никогда не переиспользуется. Ведёт себя как список врагов.
+    """
+
+    def __init__(self):
+        self.x = array('d')
+        self.y = array('d')
+        self.hp = array('i')
+        self.objects = []
+        self.handles = {}
+        self.next_handle = 0
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __getitem__(self, index):
+        return self.objects[index]
+
+    def append(self, enemy):
+        x, y = enemy.pixel_pos
+        hp = enemy.hp
+        enemy.slot = len(self.objects)
+        enemy.handle = self.next_handle
+        self.next_handle += 1
+        self.x.append(x)
+        self.y.append(y)
+        self.hp.append(hp)
+        self.objects.append(enemy)
+        self.handles[enemy.handle] = enemy
+        enemy.registry = self
+
+    def remove(self, enemy):
+        slot, last = enemy.slot, len(self.objects) - 1
+        enemy.own_pixel_pos, enemy.own_hp = (self.x[slot], self.y[slot]), self.hp[slot]
+        if slot != last:
+            moved = self.objects[slot] = self.objects[last]
+            self.x[slot], self.y[slot], self.hp[slot] = self.x[last], self.y[last], self.hp[last]
+            moved.slot = slot
+        self.objects.pop()
+        self.x.pop()
+        self.y.pop()
+        self.hp.pop()
+        del self.handles[enemy.handle]
+        enemy.registry = None
+        enemy.slot = -1
+
+    def clear(self):
+        for enemy in self.objects:
+            enemy.own_pixel_pos, enemy.own_hp = enemy.pixel_pos, enemy.hp
+            enemy.registry = None
+            enemy.slot = -1
+        self.objects.clear()
+        self.handles.clear()
+        del self.x[:], self.y[:], self.hp[:]
+
+    def get(self, handle):  # Враг по handle или None, если он уже удалён
+        return self.handles.get(handle)
+
+    def snapshot(self):  # Копии массивов и состояние ИИ: столбцы checkpoint.ENEMY_COLUMNS
+        targets = [enemy.target_pos or (math.nan, math.nan) for enemy in self.objects]
+        return (self.x[:], self.y[:], self.hp[:], array('d', (target[0] for target in targets)),
+                array('d', (target[1] for target in targets)), array('d', (enemy.seen_at for enemy in self.objects)))
+
+    def restore(self, saved):  # Заменяет врагов сохранёнными. Объекты создаются заново, handle у них новые
+        self.clear()
+        for x, y, hp, target_x, target_y, seen_at in zip(*saved):
+            enemy = Enemy((0, 0), ENEMY_TEXTURE, hp)
+            enemy.pixel_pos = (x, y)
+            enemy.target_pos = None if math.isnan(target_x) else (target_x, target_y)
+            enemy.seen_at = seen_at
+            enemy.trigger_hero()
+            self.append(enemy)
+
+
+enemies = EnemyRegistry()
+
 
 class Hero(Person):
     """
     Класс Игрока, наследуется от Person. Имеет допольнительный атрибут ammo - количество патрон / and smth more...
     """
+    __slots__ = ('pixel_pos', 'hp', 'texture', 'image', 'ammo', 'weapon', 'aiming', 'alive', 'target')
 
     def __init__(self, pos, texture, hp, ammo):
         super().__init__(pos, texture, hp)
-        self.person_texture.image = pygame.image.load(f'{SPRITES_DIR}/{texture}').convert_alpha()
+        assets.precompute_rotations(texture)
+        self.texture = texture
         self.ammo = ammo
         self.weapon = None
         self.aiming = False
         self.alive = True
-        self.image = self.person_texture.image
-
-    def render(self, screen):
-        screen.blit(self.image, self.pixel_pos)
-        font = pygame.font.Font(None, 13)
-        text = font.render(username, True, WHITE)
-        screen.blit(text, (self.pixel_pos[0], self.pixel_pos[1] - 8))
+        self.target = self.get_rect().center
+        self.image = self.texture_image
+
+    def render(self, screen, offset=(0, 0), scale=1.0):
+        x, y = (self.pixel_pos[0] - offset[0]) * scale, (self.pixel_pos[1] - offset[1]) * scale
+        rect = screen.blit(scale_surface(self.image, scale), (x, y))
+        text = scale_surface(render_text(username, 13, WHITE), scale)
+        rect.union_ip(screen.blit(text, (x, y - 8 * scale)))
         if person_hitbox_view:
-            pygame.draw.rect(screen, GREEN, self.hitbox, 1)
+            rect.union_ip(pygame.draw.rect(screen, GREEN, scale_rect(self.hitbox, offset, scale), 1))
         if self.aiming:
-            pygame.draw.line(screen, GREEN, self.get_rect().center, pygame.mouse.get_pos(), 1)
-
-    def rotate(self):
-        mouse_x, mouse_y = pygame.mouse.get_pos()
-        rel_x, rel_y = mouse_x - self.pixel_pos[0], mouse_y - self.pixel_pos[1]
+            center = (x + TILE_SIZE // 2 * scale, y + TILE_SIZE // 2 * scale)
+            target = ((self.target[0] - offset[0]) * scale, (self.target[1] - offset[1]) * scale)
+            rect.union_ip(pygame.draw.line(screen, GREEN, center, target, 1))
+        return rect
+
+    def rotate(self, target):  # Поворот к точке прицеливания target (позиция мыши в координатах карты)
+        self.target = target
+        rel_x, rel_y = target[0] - self.pixel_pos[0], target[1] - self.pixel_pos[1]
         angle = math.degrees(math.atan2(-rel_x, -rel_y))
-        self.image = pygame.transform.rotate(self.person_texture.image, int(angle))
-        self.person_texture.rect = self.image.get_rect(center=self.pixel_pos)
+        self.image = assets.rotated(self.texture, angle)
 
-    def shoot(self):
+    def shoot(self, target):
         pos = self.get_pixel_pos()
         if self.ammo > 0:
             if self.weapon == 'pistol':
-                bullets.append(Bullet(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2))
+                bullets.fire(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2, target)
                 self.ammo -= 1
             elif self.weapon == 'shotgun':
-                bullets.append(Bullet(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2, deviation=50))
-                bullets.append(Bullet(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2))
-                bullets.append(Bullet(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2, deviation=-50))
+                bullets.fire(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2, target, deviation=50)
+                bullets.fire(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2, target)
+                bullets.fire(pos[0] + TILE_SIZE // 2, pos[1] + TILE_SIZE // 2, target, deviation=-50)
                 self.ammo -= 3
-            print('Ammo:', self.ammo)
+            log('Ammo:', self.ammo)
         else:
-            print('No ammo')  # TODO: Сделать что-то с патронами
+            log('No ammo')  # TODO: Сделать что-то с патронами
 
     def aim(self):
         self.aiming = not self.aiming
 
-    def update_bullets(self, screen):
-        for bullet in bullets[:]:
-            bullet.update()
-            if not screen.get_rect().collidepoint(bullet.pos):
-                bullets.remove(bullet)
 
 
-class Bullet:
+class BulletPool:
     """
-    TODO: Сделать описание класса пули
+    Класс BulletPool хранит все пули в заранее выделенных параллельных массивах: позиция, направление,
+    скорость, угол и владелец. Выстрел занимает свободный слот, а движение, отсечение за экраном,
+    проверка стен и попадания во врагов выполняются одним проходом за кадр в update. Проверяется весь
+    отрезок, пройденный пулей за тик, поэтому быстрая пуля не проскакивает тонкую стену или врага.
+    Каждая пуля попадает не более чем в одного врага, каждый враг получает не более одной пули за кадр.
+    Если установлен NumPy, от BULLET_NUMPY_MIN пуль движение, отсечение и стены считаются массивами
+    поверх тех же буферов, а по одной проверяются только пули рядом с врагами. Результат тот же.
     """
-    def __init__(self, x, y, deviation=None):
-        self.pos = (x, y)
-        self.deviation = deviation
-        mx, my = pygame.mouse.get_pos()
-        if self.deviation:
+
+    def __init__(self, capacity=BULLET_POOL_SIZE):
+        self.capacity = capacity
+        self.x = array('d', bytes(8 * capacity))
+        self.y = array('d', bytes(8 * capacity))
+        self.dx = array('d', bytes(8 * capacity))
+        self.dy = array('d', bytes(8 * capacity))
+        self.speed = array('d', bytes(8 * capacity))
+        self.angle = array('h', bytes(2 * capacity))
+        self.owner = bytearray(capacity)
+        assets.register('bullet', self.create_image)
+        self.clear()
+
+    def __len__(self):
+        return len(self.active)
+
+    def clear(self):
+        self.free = list(range(self.capacity - 1, -1, -1))
+        self.active = []  # Слоты живых пуль в порядке выстрела
+
+    def fire(self, x, y, target, deviation=None, owner=OWNER_HERO):  # Занимает свободный слот, None если пул полон
+        if not self.free:
+            return None
+        mx, my = target
+        if deviation:
             if mx > x and my > y or mx < x and my < y:
-                self.dir = (mx - x - self.deviation, my - y + self.deviation)
+                dx, dy = mx - x - deviation, my - y + deviation
             else:
-                self.dir = (mx - x + self.deviation, my - y + self.deviation)
+                dx, dy = mx - x + deviation, my - y + deviation
         else:
-            self.dir = (mx - x, my - y)
-        length = math.hypot(*self.dir)
+            dx, dy = mx - x, my - y
+        length = math.hypot(dx, dy)
         if length == 0.0:
-            self.dir = (0, -1)
+            dx, dy = 0, -1
         else:
-            self.dir = (self.dir[0] / length, self.dir[1] / length)
-        angle = math.degrees(math.atan2(-self.dir[1], self.dir[0]))
+            dx, dy = dx / length, dy / length
+        slot = self.free.pop()
+        profiler.count('bullets_created')
+        self.x[slot], self.y[slot] = x, y
+        self.dx[slot], self.dy[slot] = dx, dy
+        self.speed[slot] = BULLET_SPEED
+        self.angle[slot] = round(math.degrees(math.atan2(-dy, dx)))
+        self.owner[slot] = owner
+        self.active.append(slot)
+        return slot
+
+    def release(self, slots):  # Освобождает слоты пачкой, порядок остальных пуль сохраняется
+        if slots:
+            slots = set(slots)
+            self.active = [slot for slot in self.active if slot not in slots]
+            self.free.extend(slots)
+
+    def get_columns(self):  # Массивы пул в порядке checkpoint.BULLET_COLUMNS
+        return self.x, self.y, self.dx, self.dy, self.speed, self.angle, self.owner
+
+    def snapshot(self):  # Копии массивов живых пуль в порядке выстрела
+        return tuple(array(code, (column[slot] for slot in self.active))
+                     for code, column in zip(checkpoint.BULLET_COLUMNS, self.get_columns()))
+
+    def restore(self, saved):
+        self.clear()
+        columns = self.get_columns()
+        for values in zip(*saved):
+            slot = self.free.pop()
+            for column, value in zip(columns, values):
+                column[slot] = value
+            self.active.append(slot)
+
+    def get_pos(self, slot):
+        return self.x[slot], self.y[slot]
+
+    def get_rect(self, slot):
+        return pygame.Rect(int(self.x[slot]) - BULLET_HITBOX // 2, int(self.y[slot]) - BULLET_HITBOX // 2,
+                           BULLET_HITBOX, BULLET_HITBOX)
+
+    def update(self, bounds, map, scale=1.0, targets=None):  # scale - доля штатного тика, targets - SpatialHash
+        if numpy is not None and len(self.active) >= BULLET_NUMPY_MIN:  # врагов. Возвращает раненых врагов
+            return self.update_arrays(bounds, map, scale, targets)
+        x, y, dx, dy, speed = self.x, self.y, self.dx, self.dy, self.speed
+        left, top, right, bottom = bounds.left, bounds.top, bounds.right, bounds.bottom
+        hit = {}
+        alive = []
+        for slot in self.active:
+            start_x, start_y = x[slot], y[slot]
+            end_x = start_x + dx[slot] * speed[slot] * scale
+            end_y = start_y + dy[slot] * speed[slot] * scale
+            wall = map.cast_ray(start_x, start_y, end_x, end_y)
+            if wall is not None:  # Пуля долетает только до стены
+                end_x = start_x + (end_x - start_x) * wall
+                end_y = start_y + (end_y - start_y) * wall
+            enemy = None
+            if targets:
+                candidates = self.get_candidates(targets, start_x, start_y, end_x, end_y)
+                enemy = self.pick_target(candidates, start_x, start_y, end_x, end_y, hit) if candidates else None
+            if enemy is not None:
+                hit[id(enemy)] = enemy
+                self.free.append(slot)
+            elif wall is None and left <= end_x < right and top <= end_y < bottom:
+                x[slot], y[slot] = end_x, end_y
+                alive.append(slot)
+            else:
+                self.free.append(slot)
+        self.active = alive
+        return list(hit.values())
+
+    def update_arrays(self, bounds, map, scale=1.0, targets=None):  # update через NumPy
+        slots = numpy.array(self.active, dtype=numpy.intp)
+        x, y = numpy.frombuffer(self.x), numpy.frombuffer(self.y)
+        start_x, start_y, speed = x[slots], y[slots], numpy.frombuffer(self.speed)[slots]
+        end_x = start_x + numpy.frombuffer(self.dx)[slots] * speed * scale
+        end_y = start_y + numpy.frombuffer(self.dy)[slots] * speed * scale
+        walls = map.cast_rays(start_x, start_y, end_x, end_y)
+        stopped = ~numpy.isnan(walls)  # Пуля долетает только до стены
+        end_x = numpy.where(stopped, start_x + (end_x - start_x) * walls, end_x)
+        end_y = numpy.where(stopped, start_y + (end_y - start_y) * walls, end_y)
+        hit = {}
+        if targets:
+            groups = {}  # Пуля -> враги, которых её отрезок может задеть, в порядке пуль
+            for i, enemy in self.find_hits(targets, start_x, start_y, end_x, end_y):
+                groups.setdefault(i, []).append(enemy)
+            for i, candidates in groups.items():
+                enemy = self.pick_target(candidates, float(start_x[i]), float(start_y[i]),
+                                         float(end_x[i]), float(end_y[i]), hit)
+                if enemy is not None:
+                    hit[id(enemy)] = enemy
+                    stopped[i] = True
+        stopped |= (end_x < bounds.left) | (end_x >= bounds.right) | (end_y < bounds.top) | (end_y >= bounds.bottom)
+        alive = ~stopped
+        x[slots[alive]], y[slots[alive]] = end_x[alive], end_y[alive]
+        self.active = slots[alive].tolist()
+        self.free.extend(slots[stopped].tolist())
+        return list(hit.values())
+
+    # Пары (номер пули, враг), где отрезок пули может задеть врага, по порядку пуль, а для одной пули -
+    # в порядке добавления в сетку
+    def find_hits(self, targets, start_x, start_y, end_x, end_y):
+        entries = {}
+        cells = []
+        for (cell_x, cell_y), cell in targets.cells.items():
+            for index, enemy in cell:
+                entries[index] = enemy
+                cells.append((cell_x, cell_y, index))
+        if not cells:
+            return []
+        order = sorted(entries)
+        enemies = [entries[index] for index in order]
+        position = numpy.zeros(order[-1] + 1, dtype=numpy.int64)
+        position[order] = numpy.arange(len(order))
+        # Ячейки врагов сортируются по номеру ячейки, дальше для каждой ячейки известны начало и число её записей
+        cells = numpy.array(cells, dtype=numpy.int64)
+        low_x, low_y = cells[:, 0].min(), cells[:, 1].min()
+        width, height = cells[:, 0].max() - low_x + 1, cells[:, 1].max() - low_y + 1
+        keys = (cells[:, 1] - low_y) * width + cells[:, 0] - low_x
+        order = numpy.argsort(keys, kind='stable')
+        owners = position[cells[order, 2]]
+        cell_counts = numpy.bincount(keys, minlength=width * height)
+        cell_starts = numpy.cumsum(cell_counts) - cell_counts
+        size, reach = targets.cell_size, BULLET_HITBOX // 2 + 1  # Те же ячейки, что читает get_candidates
+        left = (numpy.minimum(start_x, end_x).astype(numpy.int64) - reach) // size
+        right = (numpy.maximum(start_x, end_x).astype(numpy.int64) + reach) // size
+        top = (numpy.minimum(start_y, end_y).astype(numpy.int64) - reach) // size
+        bottom = (numpy.maximum(start_y, end_y).astype(numpy.int64) + reach) // size
+        pairs = []
+        for offset_y in range(int((bottom - top).max()) + 1):
+            for offset_x in range(int((right - left).max()) + 1):
+                cell_x, cell_y = left + offset_x, top + offset_y
+                valid = (cell_x <= right) & (cell_y <= bottom) & (cell_x >= low_x) & (cell_x < low_x + width) & \
+                    (cell_y >= low_y) & (cell_y < low_y + height)
+                key = numpy.where(valid, (cell_y - low_y) * width + cell_x - low_x, 0)
+                first, counts = cell_starts[key], numpy.where(valid, cell_counts[key], 0)
+                within = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+                pairs.append(numpy.repeat(numpy.arange(len(key)), counts) * len(enemies) +
+                             owners[numpy.repeat(first, counts) + within])
+        pairs = numpy.sort(numpy.concatenate(pairs))
+        if not len(pairs):
+            return []
+        pairs = pairs[numpy.concatenate(([True], pairs[1:] != pairs[:-1]))]  # Враг бывает в нескольких ячейках
+        bullet, enemy = pairs // len(enemies), pairs % len(enemies)
+        # Отсечение Лианга-Барски по прямоугольнику врага с запасом в пиксель на округление: отбрасывает только
+        # те пары, которые точная проверка в pick_target (Rect.clipline) заведомо не примет
+        margin = BULLET_HITBOX // 2 + 2
+        corners = numpy.array([enemy.pixel_pos for enemy in enemies], dtype=float)[enemy]
+        rect_left, rect_top = corners[:, 0] - margin, corners[:, 1] - margin
+        rect_right, rect_bottom = corners[:, 0] + TILE_SIZE + margin, corners[:, 1] + TILE_SIZE + margin
+        line_x, line_y = start_x[bullet], start_y[bullet]
+        line_dx, line_dy = end_x[bullet] - line_x, end_y[bullet] - line_y
+        enter, leave = numpy.zeros(len(pairs)), numpy.ones(len(pairs))
+        missed = numpy.zeros(len(pairs), dtype=bool)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for p, q in (-line_dx, line_x - rect_left), (line_dx, rect_right - line_x), \
+                    (-line_dy, line_y - rect_top), (line_dy, rect_bottom - line_y):
+                ratio = q / p
+                enter = numpy.where(p < 0, numpy.maximum(enter, ratio), enter)
+                leave = numpy.where(p > 0, numpy.minimum(leave, ratio), leave)
+                missed |= (p == 0) & (q < 0)
+        keep = ~missed & (enter <= leave)
+        return [(i, enemies[j]) for i, j in zip(bullet[keep].tolist(), enemy[keep].tolist())]
+
+    # Враги из ячеек сетки вокруг отрезка пули, в порядке добавления в сетку
+    def get_candidates(self, targets, start_x, start_y, end_x, end_y):
+        size, cells, reach = targets.cell_size, targets.cells, BULLET_HITBOX // 2 + 1
+        left, right = int(min(start_x, end_x)) - reach, int(max(start_x, end_x)) + reach
+        top, bottom = int(min(start_y, end_y)) - reach, int(max(start_y, end_y)) + reach
+        candidates = {}  # Ячейки сетки читаются напрямую: у большинства пуль рядом нет ни одного врага
+        for cell_y in range(top // size, bottom // size + 1):
+            for cell_x in range(left // size, right // size + 1):
+                for index, enemy in cells.get((cell_x, cell_y), ()):
+                    candidates[index] = enemy
+        return [candidates[index] for index in sorted(candidates)]
+
+    def pick_target(self, candidates, start_x, start_y, end_x, end_y, hit):  # Ближайший к началу отрезка
+        best, best_distance = None, None                                       # ещё не раненый враг на нём
+        for enemy in candidates:
+            if id(enemy) in hit:
+                continue
+            clip = enemy.get_rect().inflate(BULLET_HITBOX, BULLET_HITBOX).clipline(start_x, start_y, end_x, end_y)
+            if clip:
+                distance = abs(clip[0][0] - start_x) + abs(clip[0][1] - start_y)
+                if best_distance is None or distance < best_distance:
+                    best, best_distance = enemy, distance
+        return best
+
+    def create_image(self):  # Базовая текстура пули для кэша ассетов
+        image = pygame.Surface(BULLET_SIZE).convert_alpha()
+        image.fill(YELLOW)
+        return image
+
+    def draw(self, screen, offset=(0, 0), scale=1.0):  # Возвращает список областей экрана, занятых пулями
+        rects = []
+        for slot in self.active:
+            image = scale_surface(assets.rotated('bullet', self.angle[slot]), scale)
+            center = ((self.x[slot] - offset[0]) * scale, (self.y[slot] - offset[1]) * scale)
+            rects.append(screen.blit(image, image.get_rect(center=center)))
+        return rects
+
+
+bullets = BulletPool()
+
+
+class CrowdGrid:
+    """
+    Класс CrowdGrid - занятость тайлов врагами, счётчик на тайл. Каждый враг держит ровно один тайл: тот,
+    на котором стоит, или тот, куда идёт. Новый тайл занимается в момент выбора шага, старый сразу освобождается,
+    поэтому два врага никогда не идут в один тайл. Сетка меняется по ходу (move, release), а не пересчитывается:
+    проверка соседей стоит O(1) на врага, без перебора пар.
+    """
 
-        self.bullet = pygame.Surface((10, 4)).convert_alpha()
-        self.bullet.fill(YELLOW)
-        self.bullet = pygame.transform.rotate(self.bullet, angle)
-        self.speed = BULLET_SPEED
-        self.rect = self.bullet.get_rect()
+    def __init__(self, map):
+        self.map = map
+        self.counts = bytearray(map.width * map.height)
 
-    def get_pos(self):
-        return self.pos
+    def reset(self, enemies):  # Заполняет сетку заново (новая карта или восстановленный снимок)
+        self.counts = bytearray(self.map.width * self.map.height)
+        for enemy in enemies:
+            enemy.tile = -1
+            pixel_pos = enemy.target_pos or enemy.pixel_pos
+            self.move(enemy, self.map.get_index((round(pixel_pos[0] / TILE_SIZE), round(pixel_pos[1] / TILE_SIZE))))
+
+    def move(self, enemy, index):  # Освобождает тайл врага и занимает index
+        self.release(enemy)
+        if self.counts[index] < 255:
+            self.counts[index] += 1
+        enemy.tile = index
+
+    def release(self, enemy):
+        if enemy.tile >= 0 and self.counts[enemy.tile]:
+            self.counts[enemy.tile] -= 1
+        enemy.tile = -1
+
+    def is_shared(self, enemy):  # Стоит ли враг в одном тайле с другими (такие расходятся, даже не видя героя)
+        return enemy.tile >= 0 and self.counts[enemy.tile] > 1
+
+
+class SpatialHash:
+    """
+    Класс SpatialHash - равномерная сетка для поиска объектов по соседству. Объект попадает во все ячейки,
+    которые пересекает его прямоугольник. Результаты query отсортированы в порядке добавления.
+    """
+
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.count = 0
+
+    def clear(self):
+        self.cells.clear()
+        self.count = 0
+
+    def get_cells(self, rect):  # Ячейки, которые пересекает прямоугольник
+        size = self.cell_size
+        for cell_y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for cell_x in range(rect.left // size, (rect.right - 1) // size + 1):
+                yield cell_x, cell_y
+
+    def insert(self, obj, rect):
+        entry = (self.count, obj)
+        self.count += 1
+        for cell in self.get_cells(rect):
+            self.cells.setdefault(cell, []).append(entry)
+
+    def query(self, rect):  # Объекты из ячеек прямоугольника (кандидаты, точную проверку делает вызывающий)
+        found = {}
+        for cell in self.get_cells(rect):
+            for index, obj in self.cells.get(cell, ()):
+                found[index] = obj
+        return [found[index] for index in sorted(found)]
+
+
+class EnemyScheduler:
+    """
+    Класс EnemyScheduler распределяет выбор пути врагов по тикам вместо одного залпа раз в ENEMY_DELAY.
+    Враги лежат в куче по времени следующего "мышления": каждый думает раз в ENEMY_DELAY мс, враги дальше
+    AI_FAR_DISTANCE тайлов от героя - в AI_FAR_FACTOR раз реже. Начальные фазы разнесены равномерно.
+    За тик обрабатывается не больше, чем укладывается в budget_ms, остальное переносится на следующий тик,
+    а такие тики считаются как превышения бюджета. budget_ms=None снимает ограничение: тогда результат
+    зависит только от ввода, а не от скорости машины (нужно для записи и повтора сессий).
+    """
+
+    def __init__(self, budget_ms=AI_BUDGET_MS):
+        self.budget = budget_ms / 1000 if budget_ms is not None else None
+        self.heap = []
+        self.time = 0
+        self.counter = 0
+        self.updates = 0  # Метрики последнего тика
+        self.deferred = 0
+        self.cost_ms = 0
+        self.overruns = 0  # Метрики за всё время
+        self.max_cost_ms = 0
+
+    def reset(self, enemies):
+        self.heap = []
+        for i, enemy in enumerate(enemies):
+            self.schedule(enemy, self.time + ENEMY_DELAY / 1000 * i / max(len(enemies), 1))
+
+    def schedule(self, enemy, at):  # Старая запись врага в куче становится недействительной
+        self.counter += 1
+        enemy.think_at = at
+        enemy.think_token = self.counter
+        heapq.heappush(self.heap, (at, self.counter, enemy))
+
+    def wake(self, enemy):  # Подумать как можно скорее (враг дошёл до тайла)
+        self.schedule(enemy, self.time)
+
+    def get_interval(self, enemy, hero_pos):  # LOD: дальние враги думают реже
+        x, y = enemy.get_pos()
+        interval = ENEMY_DELAY / 1000
+        if abs(x - hero_pos[0]) + abs(y - hero_pos[1]) > AI_FAR_DISTANCE:
+            interval *= AI_FAR_FACTOR
+        return interval
+
+    def update(self, game, dt):
+        self.time += dt
+        start = time.perf_counter()
+        hero_pos = game.hero.get_pos()
+        self.updates = self.deferred = 0
+        while self.heap and self.heap[0][0] <= self.time:
+            if self.budget is not None and time.perf_counter() - start > self.budget:
+                self.deferred = sum(1 for entry in self.heap if entry[0] <= self.time)
+                self.overruns += 1
+                break
+            at, token, enemy = heapq.heappop(self.heap)
+            if not enemy.alive or token != enemy.think_token:
+                continue
+            if (enemy.triggering or game.crowd.is_shared(enemy)) and enemy.target_pos is None and game.is_awake(enemy):
+                game.move_enemy(enemy)
+            self.updates += 1
+            self.schedule(enemy, self.time + self.get_interval(enemy, hero_pos))
+        self.cost_ms = (time.perf_counter() - start) * 1000
+        self.max_cost_ms = max(self.max_cost_ms, self.cost_ms)
+
+    def metrics(self):  # Для сводки профайлера (FrameProfiler.add_source)
+        return {'updates': self.updates, 'deferred': self.deferred, 'cost_ms': round(self.cost_ms, 3),
+                'overruns': self.overruns, 'max_cost_ms': round(self.max_cost_ms, 3)}
+
+
+class Hud:
+    """
+    Класс Hud рисует патроны, убийства и иконки оружия на своей прозрачной поверхности. Поверхность
+    перерисовывается только при изменении ammo, kills или weapons, а в кадре выводится одним blit'ом.
+    """
+
+    def __init__(self, size=HUD_SIZE, margin=HUD_MARGIN):
+        self.margin = margin
+        self.pos = (0, 0)
+        self.scale = 1.0
+        self.scaled = None
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.state = None
+
+    def update(self, ammo):  # Возвращает True, если поверхность пришлось перерисовать
+        state = (ammo, kills, tuple(weapons))
+        if state == self.state:
+            return False
+        self.state = state
+        self.scaled = None
+        self.surface.fill((0, 0, 0, 0))
+        self.surface.blit(render_text(f'Ammo: {ammo}', 35, YELLOW), (40, 0))
+        self.surface.blit(render_text(f'Kills: {kills}', 35, RED), (40, 100))
+        if len(weapons) >= 1 and 'pistol' in weapons:
+            self.surface.blit(assets.load('1.png'), (0, 300))
+            self.surface.blit(assets.load('pistol_clear.png'), (40, 300))
+        if len(weapons) >= 2 and 'shotgun' in weapons:
+            self.surface.blit(assets.load('2.png'), (0, 400))
+            self.surface.blit(assets.load('shotgun_clear.png'), (40, 400))
+        return True
+
+    def place(self, screen_size, scale=1.0):  # HUD прижат к правому верхнему краю кадра с отступами margin
+        if scale != self.scale:
+            self.scale = scale
+            self.scaled = None
+        width = round(self.surface.get_width() * scale)
+        self.pos = (screen_size[0] - width - round(self.margin[0] * scale), round(self.margin[1] * scale))
+
+    def get_surface(self):  # Поверхность в масштабе кадра. Содержимое меняется в update, поэтому кэш свой
+        if self.scale == 1:
+            return self.surface
+        if self.scaled is None:
+            width, height = self.surface.get_size()
+            self.scaled = pygame.transform.scale(self.surface, (round(width * self.scale), round(height * self.scale)))
+        return self.scaled
 
     def get_rect(self):
-        return pygame.Rect(self.pos[0], self.pos[1], self.bullet.get_width(), self.bullet.get_height())
+        return self.get_surface().get_rect(topleft=self.pos)
+
+    def render(self, screen, ammo):
+        self.update(ammo)
+        return screen.blit(self.get_surface(), self.pos)
+
+
+class Camera:
+    """
+    Класс Camera - видимая область карты в пикселях. Держит героя в центре, но не выходит за края карты;
+    карта меньше экрана остаётся прижатой к левому верхнему углу. Вокруг камеры есть зона бодрствования:
+    враги за её пределами спят.
+    """
+
+    def __init__(self, size=WINDOW_SIZE):
+        self.rect = pygame.Rect((0, 0), size)
+        self.awake = self.rect.inflate(ENEMY_WAKE_MARGIN * 2, ENEMY_WAKE_MARGIN * 2)
 
-    def update(self):
-        self.pos = (self.pos[0] + self.dir[0] * self.speed,
-                    self.pos[1] + self.dir[1] * self.speed)
+    def follow(self, center, world_size):
+        self.rect.x = max(0, min(int(center[0]) - self.rect.width // 2, world_size[0] - self.rect.width))
+        self.rect.y = max(0, min(int(center[1]) - self.rect.height // 2, world_size[1] - self.rect.height))
+        self.awake.center = self.rect.center
 
-    def draw(self, screen):
-        bullet_rect = self.bullet.get_rect(center=self.pos)
-        screen.blit(self.bullet, bullet_rect)
+    def to_world(self, pos):  # Экранные координаты (мышь) -> координаты карты
+        return pos[0] + self.rect.x, pos[1] + self.rect.y
 
-    def get_tile_pos(self, pos):
-        bullet_rect = self.bullet.get_rect(center=pos)
-        return bullet_rect[0] // TILE_SIZE, bullet_rect[1] // TILE_SIZE
+    def to_screen(self, pos):
+        return pos[0] - self.rect.x, pos[1] - self.rect.y
 
 
 class Game:
     """
     Класс Game управляет логикой и ходом игры. При инициализации получает объект карты и объекты существ.
+    Всё, что дальше от камеры, чем ENEMY_WAKE_MARGIN, не обновляется и не рисуется.
     """
 
-    def __init__(self, map, hero):
+    def __init__(self, map, hero, ai_budget_ms=AI_BUDGET_MS, view_size=WINDOW_SIZE):
         self.map = map
         self.hero = hero
-
-    def render(self, screen):  # Синхронизированная отрисовка
-        global enemy_event, kills, lose
-        self.map.render(screen)
-        self.hero.render(screen)
-        hero_rect = self.hero.get_rect()
-        for enemy in enemies:
-            if hero_rect.colliderect(enemy.trigger_rect):
-                enemy.triggering = True
-            else:
-                enemy.triggering = False
-            if enemy.get_rect().colliderect(hero_rect):
-                self.hero.alive = False
-                lose = True
-            if self.check_enemy_for_bullet(enemy):
-                if enemy.triggering and enemy_event:
-                    self.move_enemy(enemy)
-                    enemy.trigger_hero()
-                enemy.render(screen)
-            else:
+        self.enemy_hash = SpatialHash()
+        self.triggered = []
+        self.hud = Hud()
+        self.dirty = []  # Области, занятые сущностями в прошлом кадре (для режима dirty_rects)
+        self.full_redraw = True
+        self.camera = Camera(view_size)
+        self.camera.follow(hero.get_rect().center, map.pixel_size)
+        self.drawn_view = None  # Позиция камеры и масштаб последнего отрисованного кадра
+        self.scale = 1.0
+        self.bounds = self.camera.rect  # Пули за пределами видимой области исчезают
+        self.scheduler = EnemyScheduler(ai_budget_ms)
+        self.scheduler.reset(enemies)
+        profiler.add_source('ai', self.scheduler.metrics)  # Превышения бюджета ИИ и самый дорогой тик в сводке
+        self.crowd = CrowdGrid(map)
+        self.crowd.reset(enemies)
+        map.reset_flow_field()
+        self.checkpoint = self.snapshot()  # Состояние на начало текущего уровня
+
+    def restore_background(self, screen, rect):  # Затирает область экрана фоном из чанков карты
+        screen.fill(BLACK, rect)
+        self.map.render(screen, self.camera.rect.topleft, rect, self.scale)
+
+    def snapshot(self):  # Полное состояние игры в памяти (checkpoint.GameState), диск не трогается
+        hero = self.hero
+        return checkpoint.GameState(map_number, difficulty, kills, tuple(weapons), win, lose, self.scheduler.time,
+                                    hero.get_pixel_pos(), hero.hp, hero.ammo, hero.weapon, hero.aiming, hero.target,
+                                    enemies.snapshot(), bullets.snapshot())
+
+    # Возвращает игру в снимок state. Карта берётся из LevelCache: ресурсы не перезагружаются, а TMX
+    # не разбирается, если карта ещё в кэше. level_start - снимок начала уровня state
+    def restore(self, state, level_start=None):
+        global map_number, kills, win, lose
+        start = time.perf_counter()
+        set_difficulty(state.difficulty)
+        if level_start is not None:
+            self.checkpoint = level_start
+        elif state.map_number != map_number:  # Начало другого уровня неизвестно: R вернёт в сам снимок
+            self.checkpoint = state
+        if state.map_number != map_number:
+            self.map = levels.get(f'map{state.map_number}.tmx')
+            levels.prefetch(f'map{state.map_number + 1}.tmx')
+        map_number, kills, win, lose = state.map_number, state.kills, state.win, state.lose
+        weapons[:] = state.weapons
+        enemies.restore(state.enemies)
+        bullets.restore(state.bullets)
+        hero = self.hero
+        hero.set_pixel_pos(state.hero_pos)
+        hero.hp, hero.ammo, hero.weapon, hero.aiming = state.hero_hp, state.ammo, state.weapon, state.aiming
+        hero.alive = not state.lose
+        hero.rotate(state.target)
+        self.scheduler.time = state.time
+        self.scheduler.reset(enemies)
+        self.crowd = CrowdGrid(self.map)
+        self.crowd.reset(enemies)
+        self.map.reset_flow_field()
+        self.triggered = []
+        self.camera.follow(hero.get_rect().center, self.map.pixel_size)
+        self.full_redraw = True
+        log(f'State restored: map{map_number}, {len(enemies)} enemies in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    def get_flow_bounds(self):  # Окно поля путей в тайлах: зона бодрствования с запасом FLOW_FIELD_MARGIN
+        awake = self.camera.awake
+        left, top = awake.left // TILE_SIZE - FLOW_FIELD_MARGIN, awake.top // TILE_SIZE - FLOW_FIELD_MARGIN
+        right = -(-awake.right // TILE_SIZE) + FLOW_FIELD_MARGIN
+        bottom = -(-awake.bottom // TILE_SIZE) + FLOW_FIELD_MARGIN
+        return pygame.Rect(left, top, right - left, bottom - top).clip(0, 0, self.map.width, self.map.height)
+
+    def is_awake(self, enemy):
+        return self.camera.awake.collidepoint(enemy.pixel_pos)
+
+    def step(self, inputs, dt=TICK, world=False):  # Один тик симуляции без отрисовки: ввод, герой, враги, пули.
+        global kills                                 # world - прицел уже в координатах карты (ввод по сети)
+        if win or lose:
+            return
+        if not world:
+            inputs = inputs._replace(target=self.camera.to_world(inputs.target))
+        if inputs.shoot and weapons:
+            self.hero.shoot(inputs.target)
+        if inputs.aim:
+            self.hero.aim()
+        with profiler.phase('update_hero'):
+            self.update_hero(inputs, dt)
+            self.camera.follow(self.hero.get_rect().center, self.map.pixel_size)
+        with profiler.phase('enemies'):
+            self.index_enemies()
+            self.check_enemy_for_hero()
+        with profiler.phase('bullets'):
+            wounded = self.check_enemy_for_bullet(dt)
+        with profiler.phase('enemies'):
+            dead = []
+            for enemy in wounded:
                 if self.hero.weapon == 'pistol':
                     enemy.hp -= PISTOL_DAMAGE
                 elif self.hero.weapon == 'shotgun':
                     enemy.hp -= SHOTGUN_DAMAGE
-                print(f'{enemy} wounded   HP:{enemy.hp}')
+                log(f'{enemy} wounded   HP:{enemy.hp}')
                 if enemy.hp <= 0:
                     kills += 1
-                    enemies.remove(enemy)
-                    print(f'{enemy} killed')
-        enemy_event = False
-        self.hero.update_bullets(screen)
-        font = pygame.font.Font(None, 35)
-        hero_ammo = font.render(f'Ammo: {self.hero.ammo}', True, YELLOW)
-        hero_kills = font.render(f'Kills: {kills}', True, RED)
-        if weapons:
-            if len(weapons) >= 1 and 'pistol' in weapons:
-                screen.blit(one_image, (1290, 500))
-                screen.blit(pistol_image, (1330, 500))
-            if len(weapons) >= 2 and 'shotgun' in weapons:
-                screen.blit(two_image, (1290, 600))
-                screen.blit(shotgun_image, (1330, 600))
-        screen.blit(hero_ammo, (1330, 200))
-        screen.blit(hero_kills, (1330, 300))
-        for bullet in bullets:
-            if self.check_wall_for_bullet(bullet):
-                bullet.draw(screen)
+                    dead.append(enemy)
+                    log(f'{enemy} killed')
+            for enemy in dead:
+                enemy.alive = False
+                enemies.remove(enemy)
+                self.crowd.release(enemy)
+            self.map.update_flow_field(self.hero.get_pos(), self.get_flow_bounds(), FLOW_FIELD_TILES_PER_TICK)
+            self.scheduler.update(self, dt)
+            speed = ENEMY_SPEED * dt * FPS
+            awake, x, y = self.camera.awake, enemies.x, enemies.y
+            for slot, enemy in enumerate(enemies.objects):
+                if enemy.target_pos is not None and awake.collidepoint(x[slot], y[slot]) and enemy.advance(speed):
+                    self.scheduler.wake(enemy)
+            profiler.count('ai_updates', self.scheduler.updates)
+            profiler.count('ai_deferred', self.scheduler.deferred)
+
+    def render(self, screen, scale=1.0):  # Отрисовка текущего состояния в кадр с внутренним разрешением scale
+        view = self.camera.rect            # (см. display). Возвращает список изменившихся областей кадра
+        offset = view.topleft
+        full_redraw = self.full_redraw or not dirty_rects or (offset, scale) != self.drawn_view  # Камера сдвинулась
+        self.scale = scale
+        with profiler.phase('map'):
+            if full_redraw:
+                screen.fill(BLACK)
+                self.map.render(screen, offset, scale=scale)
             else:
-                bullets.remove(bullet)
-
-    def check_enemy_for_bullet(self, enemy):
-        for bullet in bullets:
-            if bullet.get_rect().colliderect(enemy.get_rect()):
-                bullets.remove(bullet)
-                return False
-        return True
+                for rect in self.dirty:
+                    self.restore_background(screen, rect)
+            self.map.stream(view)
+        with profiler.phase('entities'):
+            sprites = [self.hero]
+            left, top = view.left - TILE_SIZE, view.top - TILE_SIZE
+            right, bottom = view.right, view.bottom
+            x, y = enemies.x, enemies.y
+            for slot, enemy in enumerate(enemies.objects):
+                if left < x[slot] < right and top < y[slot] < bottom:
+                    sprites.append(enemy)
+            drawn = [sprite.render(screen, offset, scale) for sprite in sprites]
+            profiler.count('enemies_drawn', len(drawn) - 1)
+            bullet_rects = bullets.draw(screen, offset, scale)
+        with profiler.phase('hud'):  # HUD рисуется поверх всего. Если под ним что-то стёрли или нарисовали,
+            self.hud.place(screen.get_size(), scale)  # область HUD собирается заново: фон, сущности, HUD
+            hud_changed = self.hud.update(self.hero.ammo)
+            hud_rect = self.hud.get_rect()
+            redraw_hud = full_redraw or hud_changed or hud_rect.collidelist(self.dirty) != -1 or \
+                hud_rect.collidelist(drawn) != -1 or hud_rect.collidelist(bullet_rects) != -1
+            if redraw_hud and not full_redraw:
+                screen.set_clip(hud_rect)
+                self.restore_background(screen, hud_rect)
+                for sprite, rect in zip(sprites, drawn):
+                    if rect.colliderect(hud_rect):
+                        sprite.render(screen, offset, scale)
+                if hud_rect.collidelist(bullet_rects) != -1:
+                    bullets.draw(screen, offset, scale)
+                screen.set_clip(None)
+            if redraw_hud:
+                self.hud.render(screen, self.hero.ammo)
+        drawn.extend(bullet_rects)
+        if full_redraw:
+            changed = [screen.get_rect()]
+        else:
+            changed = self.dirty + drawn
+            if redraw_hud:
+                changed.append(hud_rect)
+        self.dirty = drawn
+        self.full_redraw = False
+        self.drawn_view = offset, scale
+        return changed
+
+    def index_enemies(self):  # Перестраивает пространственный индекс бодрствующих врагов, вызывается раз в кадр.
+        self.enemy_hash.clear()  # Спящие враги далеко и от героя, и от пуль, поэтому в индекс не попадают
+        awake, x, y = self.camera.awake, enemies.x, enemies.y
+        for slot, enemy in enumerate(enemies.objects):
+            if awake.collidepoint(x[slot], y[slot]):
+                self.enemy_hash.insert(enemy, pygame.Rect(x[slot], y[slot], TILE_SIZE, TILE_SIZE))
+
+    def check_enemy_for_hero(self):  # Триггер и касание героя проверяются только у врагов по соседству.
+        global lose                    # Враг агрится, только если видит героя (или видел недавно)
+        for enemy in self.triggered:
+            enemy.triggering = False
+        hero_rect = self.hero.get_rect()
+        hero_pos = self.hero.get_pos()
+        now = self.scheduler.time
+        reach = ENEMY_TRIGGER_SIZE * TILE_SIZE
+        self.triggered = []
+        for enemy in self.enemy_hash.query(hero_rect.inflate(reach, reach)):
+            if hero_rect.colliderect(enemy.trigger_rect):
+                if self.map.has_line_of_sight(enemy.get_pos(), hero_pos):
+                    enemy.seen_at = now
+                if now - enemy.seen_at <= ENEMY_AGGRO_MEMORY:
+                    enemy.triggering = True
+                    self.triggered.append(enemy)
+            if enemy.get_rect().colliderect(hero_rect):
+                self.hero.alive = False
+                lose = True
 
-    def check_wall_for_bullet(self, bullet):  # Проверка на стену для пули
-        if self.map.get_tile_id(bullet.get_tile_pos(bullet.get_pos())) not in self.map.free_tiles:
-            return False
-        return True
+    def check_enemy_for_bullet(self, dt=TICK):  # Двигает пули на тик и возвращает раненых врагов (см. BulletPool)
+        return bullets.update(self.bounds, self.map, dt * FPS, self.enemy_hash)
 
     def check_wall_for_player(self, next_pixel_x, next_pixel_y):  # Проверка на стену для игрока
         tile = (round(next_pixel_x / TILE_SIZE), round(next_pixel_y / TILE_SIZE))
         player_hitbox_rect = self.hero.get_rect()
         for y in range(tile[1] - 1, tile[1] + 2):
             for x in range(tile[0] - 1, tile[0] + 2):
-                if self.map.get_tile_id((x, y)) not in self.map.free_tiles:
+                if not self.map.is_free((x, y)):
                     wall_tile = pygame.Rect(x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
                     if wall_tile.colliderect(player_hitbox_rect):
                         if wall_tile.collidepoint(player_hitbox_rect.midleft):
@@ -366,40 +1489,27 @@ class Game:
                             next_pixel_y -= MOVE_SPEED
         return next_pixel_x, next_pixel_y
 
-    def update_hero(self):  # Обработка Игрока
+    def update_hero(self, inputs, dt=TICK):  # Обработка Игрока
         global map_number, win
 
-        self.hero.rotate()
+        self.hero.rotate(inputs.target)
 
         next_pixel_x, next_pixel_y = self.hero.get_pixel_pos()
-        key = pygame.key.get_pressed()
-
-        # if key[pygame.K_LCTRL]:
-        #     self.hero.shoot()
-
-        if key[pygame.K_1]:
-            if len(weapons) >= 1:
-                self.hero.weapon = weapons[0]
-        if key[pygame.K_2]:
-            if len(weapons) >= 2:
-                self.hero.weapon = weapons[1]
-
-        if key[pygame.K_a] or key[pygame.K_LEFT]:
-            next_pixel_x -= MOVE_SPEED
-        if key[pygame.K_d] or key[pygame.K_RIGHT]:
-            next_pixel_x += MOVE_SPEED
-        if key[pygame.K_w] or key[pygame.K_UP]:
-            next_pixel_y -= MOVE_SPEED
-        if key[pygame.K_s] or key[pygame.K_DOWN]:
-            next_pixel_y += MOVE_SPEED
+
+        if inputs.weapon and len(weapons) >= inputs.weapon:
+            self.hero.weapon = weapons[inputs.weapon - 1]
+
+        speed = MOVE_SPEED * dt * FPS
+        next_pixel_x += inputs.dx * speed
+        next_pixel_y += inputs.dy * speed
 
         self.hero.set_pixel_pos(self.check_wall_for_player(next_pixel_x, next_pixel_y))
 
-        if self.map.get_tile_id(self.hero.get_pos()) in self.map.trigger_tiles:  # Если игрок активировал триггер карты
+        if self.map.is_trigger(self.hero.get_pos()):  # Если игрок активировал триггер карты
             triggger_id = self.map.get_tile_id(self.hero.get_pos())
             if triggger_id == 8:  # Смена карты
                 map_number += 1
-                self.change_map(self.map, f'map{map_number}.tmx', [0, 8, 16, 13, 7, 15, 23], [7, 8, 13, 23])
+                self.change_map(f'map{map_number}.tmx')
             if triggger_id == 13:
                 win = True
             if triggger_id == 7:
@@ -409,118 +1519,172 @@ class Game:
                 if 'shotgun' not in weapons:
                     weapons.append('shotgun')
 
-    def move_enemy(self, enemy):  # TODO: Пофиксить кривое перермещение врагов по тайлам (сделать плавное пиксельное)
-        enemy_pos = enemy.get_pos()
-        enemy_pixel_pos = list(enemy.get_pixel_pos())
-        next_pos = self.map.find_path_step(enemy_pos, self.hero.get_pos())
-        direction = 'stay'
-        if next_pos[0] > enemy_pos[0]:
-            direction = 'right'
-        elif next_pos[0] < enemy_pos[0]:
-            direction = 'left'
-        elif next_pos[1] > enemy_pos[1]:
-            direction = 'down'
-        elif next_pos[1] < enemy_pos[1]:
-            direction = 'up'
-        dt = 5
-        for i in range(5):
-            if direction == 'right':
-                enemy_pixel_pos[0] += dt
-            elif direction == 'left':
-                enemy_pixel_pos[0] -= dt
-            elif direction == 'down':
-                enemy_pixel_pos[1] += dt
-            elif direction == 'up':
-                enemy_pixel_pos[1] -= dt
-            enemy.set_pixel_pos(enemy_pixel_pos)
-
-    def change_map(self, map_object, map_filename, free_tiles, trigger_tiles):
+    def move_enemy(self, enemy):  # Выбирает следующий свободный тайл пути и занимает его в CrowdGrid,
+        pos = enemy.get_pos()        # само движение идёт плавно в Enemy.advance
+        next_pos = self.map.find_path_step(pos, occupied=self.crowd.counts)
+        if next_pos != pos:
+            self.crowd.move(enemy, self.map.get_index(next_pos))
+            enemy.target_pos = self.map.get_tile_coords(next_pos)
+
+    def change_map(self, map_filename):  # Подменяет карту на заранее подготовленную и ставит в очередь следующую
         bullets.clear()
         enemies.clear()
-        print(f'map{map_number - 1} changed to map{map_number}')
-        map_object.__init__(map_filename, free_tiles, trigger_tiles)
-        self.hero.set_pos(map_object.spawn_pos)
-
+        log(f'map{map_number - 1} changed to map{map_number}')
+        self.map = levels.get(map_filename)
+        self.map.spawn_enemies()
+        self.scheduler.reset(enemies)
+        self.crowd = CrowdGrid(self.map)
+        self.crowd.reset(enemies)
+        self.map.reset_flow_field()
+        self.hero.set_pos(self.map.spawn_pos)
+        self.camera.follow(self.hero.get_rect().center, self.map.pixel_size)
+        self.full_redraw = True
+        levels.prefetch(f'map{map_number + 1}.tmx')
+        self.checkpoint = self.snapshot()
+
+
+def new_game(deterministic=False):  # Игра с начала карты map_number. deterministic - ИИ без бюджета по времени
+    map = levels.get(f'map{map_number}.tmx')
+    map.spawn_enemies()
+    levels.prefetch(f'map{map_number + 1}.tmx')
+    hero = Hero(map.spawn_pos, 'hero.png', PLAYER_HP, 1001)
+    return Game(map, hero, None if deterministic else AI_BUDGET_MS)
 
-def main():
-    global enemy_event, enemy_hp
 
-    pygame.mixer.pre_init(44100, -16, 1, 512)
-    pygame.init()
-    clock = pygame.time.Clock()
-    pygame.time.set_timer(ENEMY_EVENT_TYPE, ENEMY_DELAY)
+# Основной цикл игры. initialised - pygame и микшер уже подготовлены (например, меню), init_pygame не вызывается,
+# а окно Display всё равно открывает заново под свои флаги и масштаб. record_path - файл для записи ввода
+# (см. replay.py). pacing и dynamic переопределяют frame_pacing и dynamic_resolution из config.ini
+def main(initialised=False, record_path=None, pacing=None, dynamic=None):
+    load_config()
+    if not initialised:
+        init_pygame()
     pygame.display.set_caption('Hot Rooms')
-    screen = pygame.display.set_mode(WINDOW_SIZE, pygame.FULLSCREEN)
-
-    if difficulty == 'Hard':
-        enemy_hp *= 2
-
-    font = pygame.font.Font(None, 200)
+    pacer = FramePacer(pacing or frame_pacing)
+    display = Display(pacer, dynamic_resolution if dynamic is None else dynamic)
 
-    map = Map(f'map{map_number}.tmx', [0, 8, 16, 13, 7, 15, 23], [7, 8, 13, 23])
-    hero = Hero(map.spawn_pos, 'hero.png', PLAYER_HP, 1001)
-
-    game = Game(map, hero)
+    seed = random.randrange(2 ** 32)
+    random.seed(seed)
+    recorder = None
+    if record_path:
+        from replay import InputRecorder  # replay.py сам импортирует main
+        recorder = InputRecorder(record_path, seed, map_number, difficulty)
+    game = new_game(deterministic=recorder is not None)
+    start_state = game.checkpoint  # После победы R начинает игру с первой карты
 
-    track = choice(PLAYLIST)
-    pygame.mixer.music.load(track)
-    print(f'Now playing: {track}')
-    PLAYLIST.remove(track)
-    track = choice(PLAYLIST)
-    pygame.mixer.music.queue(track)
-    PLAYLIST.remove(track)
-    pygame.mixer.music.set_endevent(pygame.USEREVENT)
-    pygame.mixer.music.play()
+    music = Playlist(rng=random.Random(seed))
+    music.start()
 
     running = True
     count = 0
+    accumulator = 0
+    carry = None  # Клики из кадра, в котором не случилось ни одного тика
+    surfaces_built = assets.misses + texts.misses
     while running:
-        clock.tick(FPS)
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-                break
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    if weapons:
-                        hero.shoot()
-                if event.button == 3:
-                    hero.aim()
-            if event.type == pygame.KEYDOWN:
-                if pygame.key.get_pressed()[pygame.K_ESCAPE]:
-                    exit('Game closed')
-            if event.type == ENEMY_EVENT_TYPE:
-                enemy_event = True
-            if event.type == pygame.USEREVENT:
-                print(f'Now playing: {track}')
-                if len(PLAYLIST) > 0:
-                    track = choice(PLAYLIST)
-                    pygame.mixer.music.queue(track)
-                    PLAYLIST.remove(track)
-        screen.fill((0, 0, 0))
+        accumulator += pacer.tick()
+        screen = display.screen
+        profiler.begin_frame()
+        with profiler.phase('events'):
+            events = pygame.event.get()
+            for event in events:
+                if event.type == pygame.QUIT:
+                    running = False
+                    break
+                if event.type == pygame.KEYDOWN:
+                    if pygame.key.get_pressed()[pygame.K_ESCAPE]:
+                        if recorder:
+                            recorder.close(game)
+                        profiler.close()
+                        music.shutdown()
+                        exit('Game closed')
+                    if event.key == pygame.K_F3:
+                        profiler.toggle_overlay()
+                        game.full_redraw = True
+                    if event.key == pygame.K_F5 and not (win or lose):
+                        try:
+                            checkpoint.save(CHECKPOINT_PATH, game.snapshot(), game.checkpoint)
+                            print(f'Checkpoint saved to {CHECKPOINT_PATH}')
+                        except OSError as error:
+                            print(f'Checkpoint not saved: {error}')
+                    if event.key == pygame.K_F9 or event.key == pygame.K_r and (win or lose):
+                        if recorder:  # Повтор не знает о подменах состояния
+                            print('Restoring is disabled while recording')
+                        elif event.key == pygame.K_F9:
+                            try:
+                                game.restore(*checkpoint.load(CHECKPOINT_PATH))
+                            except (OSError, ValueError) as error:
+                                print(f'Checkpoint not loaded: {error}')
+                        else:
+                            game.restore(start_state if win else game.checkpoint)
+                        accumulator = 0
+                music.handle_event(event)
+            music.update()
+            inputs = read_inputs(events, display)
+            if carry:
+                inputs = inputs._replace(shoot=inputs.shoot or carry.shoot, aim=inputs.aim != carry.aim)
+        steps = 0
+        while accumulator >= TICK and steps < MAX_STEPS_PER_FRAME:  # Логика идёт фиксированным шагом TICK
+            if recorder:
+                recorder.write(inputs)
+            game.step(inputs, TICK)
+            inputs = inputs._replace(shoot=False, aim=False)  # Клики применяются только в первом тике
+            accumulator -= TICK
+            steps += 1
+        if steps == MAX_STEPS_PER_FRAME:
+            accumulator = 0
+        carry = inputs if steps == 0 else None
+        if win or lose:
+            screen.fill((0, 0, 0))
         if win:
-            text = font.render("Victory!", True, GREEN)
-            text_x = WINDOW_WIDTH // 2.5 - text.get_width() // 2
-            text_y = WINDOW_HEIGHT // 2.5 - text.get_height() // 2
+            text = scale_surface(render_text("Victory!", 200, GREEN), display.scale)
+            text_x = screen.get_width() // 2.5 - text.get_width() // 2
+            text_y = screen.get_height() // 2.5 - text.get_height() // 2
             screen.blit(text, (text_x, text_y))
         elif lose:
-            text = font.render("Defeat", True, RED)
-            text_x = WINDOW_WIDTH // 2.5 - text.get_width() // 2
-            text_y = WINDOW_HEIGHT // 2.5 - text.get_height() // 2
+            text = scale_surface(render_text("Defeat", 200, RED), display.scale)
+            text_x = screen.get_width() // 2.5 - text.get_width() // 2
+            text_y = screen.get_height() // 2.5 - text.get_height() // 2
             screen.blit(text, (text_x, text_y))
+        if win or lose:
+            hint = scale_surface(render_text('Press R to play again' if win else 'Press R to restart the level',
+                                             60, WHITE), display.scale)
+            screen.blit(hint, (screen.get_width() // 2.5 - hint.get_width() // 2, text_y + text.get_height()))
         else:
-            game.update_hero()
-            game.render(screen)
-        pygame.display.flip()
+            changed = game.render(screen, display.scale)
+        overlay = profiler.render(screen, display.scale)
+        with profiler.phase('flip'):
+            if dirty_rects and not (win or lose):
+                if overlay:
+                    changed.append(overlay)
+                    game.dirty.append(overlay)
+                pygame.display.update(changed)
+            else:
+                pygame.display.flip()
+        profiler.count('surfaces_built', assets.misses + texts.misses - surfaces_built)
+        surfaces_built = assets.misses + texts.misses
+        profiler.end_frame()
+        if display.update(profiler.frames[-1] - profiler.phases.get('flip', 0) * 1000):  # Без ожидания vsync
+            game.full_redraw = True
         count += 1
         if count % FPS == 0:
             if count // FPS % 60 < 10:
-                time = f'{count // FPS // 60}:0{count // FPS % 60}'
+                played = f'{count // FPS // 60}:0{count // FPS % 60}'
             else:
-                time = f'{count // FPS // 60}:{count // FPS % 60}'
-            print('FPS:', int(clock.get_fps()), '   time:', time)
+                played = f'{count // FPS // 60}:{count // FPS % 60}'
+            print('FPS:', int(pacer.get_fps()), '   time:', played, '   scale:', display.scale)
+    if recorder:
+        recorder.close(game)
+    music.shutdown()
 
 
 if __name__ == '__main__':
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Hot Rooms')
+    parser.add_argument('--record', metavar='PATH', help='записать ввод сессии для replay.py')
+    parser.add_argument('--pacing', choices=('vsync', 'cap', 'uncapped'), help='ограничение FPS')
+    parser.add_argument('--fixed-resolution', action='store_true', help='не менять внутреннее разрешение')
+    args = parser.parse_args()
+    main(record_path=args.record, pacing=args.pacing, dynamic=False if args.fixed_resolution else None)
+    profiler.close()
+    levels.shutdown()
     pygame.quit()
@@ -1,14 +1,15 @@
-import os
-
 import pygame
 import pygame_menu
 from pygame_menu import themes
 from configparser import ConfigParser
 
+import main
+
 
 def menu():
-    pygame.init()
+    main.init_pygame()
     surface = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+    main.preload()  # Пока открыто меню, первая карта и текстуры грузятся в фоне
 
     config = ConfigParser()
     config.read('config.ini')
@@ -22,10 +23,12 @@ def menu():
     def start_the_game():
         for value in mainmenu.get_input_data().values():
             config['CONFIG']['username'] = value
-        os.system("start cmd /k python main.py")
-        os.system("taskkill /F /IM cmd.exe")
         with open('config.ini', mode='w') as configfile:
             config.write(configfile)
+        main.main(initialised=True)  # Игра запускается в этом же процессе, pygame и микшер уже готовы
+        main.profiler.close()
+        main.levels.shutdown()
+        pygame.quit()
         exit()
 
     def level_menu():
@@ -67,4 +70,5 @@ def menu():
         pygame.display.update()
 
 
-menu()
+if __name__ == '__main__':
+    menu()
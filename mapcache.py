@@ -0,0 +1,148 @@
+"""
+Бинарный кэш карт. Рядом с каждым maps/mapN.tmx лежит mapN.tmx.cache, в котором сохранены:
+ID тайлов, маски проходимости и триггеров, точка появления героя, тайлы спавна врагов, номер картинки
+в атласе для каждой клетки слоя и сам атлас: по одной картинке TILE_SIZE x TILE_SIZE (RGB) на каждый
+различный тайл слоя. Чанки по MAP_CHUNK_TILES тайлов Map запекает из атласа, когда они попадают в камеру,
+так что размер кэша растёт с числом клеток карты, а не пикселей. Файл открывается через mmap, массивы
+читаются из него без копирования.
+
+Кэш считается устаревшим, если поменялись версия формата, размер тайла или чанка, списки проходимых тайлов
+и тайлов-триггеров или исходники карты: TMX, его тайлсеты (*.tsx) и их картинки. Исходники сверяются
+по размеру и mtime, а если те поменялись - по CRC32 содержимого. Чтобы пересобрать кэш вручную,
+достаточно удалить *.cache.
+"""
+import os
+import mmap
+import zlib
+import struct
+from collections import namedtuple
+from xml.etree import ElementTree
+
+import pygame
+
+from constants import *
+
+MAGIC = b'HRMC'
+VERSION = 3
+# magic, версия, ширина, высота, размер тайла, размер чанка, спавн героя x/y, врагов, картинок в атласе,
+# подпись размеров и mtime исходников, CRC32 исходников, подпись списков тайлов
+HEADER = struct.Struct('<4sHHHHHhhIHIII')
+
+# cells - номер картинки атласа для каждой клетки (0 - пустая клетка), atlas - байты RGB картинок подряд
+MapData = namedtuple('MapData', ['width', 'height', 'spawn_pos', 'enemy_spawns',
+                                 'tiles', 'passable', 'triggers', 'cells', 'atlas'])
+
+tobytes = getattr(pygame.image, 'tobytes', None) or pygame.image.tostring
+frombytes = getattr(pygame.image, 'frombytes', None) or pygame.image.fromstring
+
+
+def get_cache_path(tmx_path):
+    return tmx_path + '.cache'
+
+
+def get_chunk_rects(width, height):  # Пиксельные области чанков карты width x height тайлов, построчно
+    step = MAP_CHUNK_TILES * TILE_SIZE
+    return [pygame.Rect(x, y, min(step, width * TILE_SIZE - x), min(step, height * TILE_SIZE - y))
+            for y in range(0, height * TILE_SIZE, step)
+            for x in range(0, width * TILE_SIZE, step)]
+
+
+def get_signature(free_tiles, trigger_tiles):  # Маски зависят от списков тайлов, поэтому они входят в ключ кэша
+    return zlib.crc32(repr((sorted(free_tiles), sorted(trigger_tiles))).encode())
+
+
+def get_sources(tmx_path):  # TMX и файлы, из которых собирается его слой: внешние тайлсеты и их картинки
+    sources = [tmx_path]
+    directory = os.path.dirname(tmx_path)
+    for _, element in ElementTree.iterparse(tmx_path):
+        if element.tag == 'layer':  # Тайлсеты в TMX идут до слоёв, дальше только данные карты
+            break
+        if element.tag == 'tileset' and element.get('source'):
+            tileset_path = os.path.join(directory, element.get('source'))
+            sources.append(tileset_path)
+            tileset_directory = os.path.dirname(tileset_path)
+            sources.extend(os.path.join(tileset_directory, image.get('source'))
+                           for image in ElementTree.parse(tileset_path).iter('image'))
+        elif element.tag == 'image':  # Картинка тайлсета, встроенного в TMX
+            sources.append(os.path.join(directory, element.get('source')))
+    return sources
+
+
+def get_stamp(sources):  # Быстрая подпись исходников: размеры и mtime
+    return zlib.crc32(repr([(stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, sources)]).encode())
+
+
+def get_crc(sources):
+    crc = 0
+    for path in sources:
+        with open(path, mode='rb') as file:
+            crc = zlib.crc32(file.read(), crc)
+    return crc
+
+
+def load(tmx_path, free_tiles, trigger_tiles):  # MapData из кэша или None, если кэша нет или он устарел
+    cache_path = get_cache_path(tmx_path)
+    try:
+        file = open(cache_path, mode='rb')
+    except OSError:
+        return None
+    with file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+    if len(buffer) < HEADER.size:
+        return None
+    magic, version, width, height, tile_size, chunk_tiles, spawn_x, spawn_y, enemy_count, atlas_count, stamp, \
+        crc, signature = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION or tile_size != TILE_SIZE or chunk_tiles != MAP_CHUNK_TILES or \
+            signature != get_signature(free_tiles, trigger_tiles):
+        return None
+    try:
+        sources = get_sources(tmx_path)
+        if get_stamp(sources) != stamp and get_crc(sources) != crc:
+            return None
+    except (OSError, ElementTree.ParseError):
+        return None
+    count = width * height
+    expected = HEADER.size + count * 6 + enemy_count * 4 + atlas_count * TILE_SIZE * TILE_SIZE * 3
+    if len(buffer) != expected:
+        return None
+    view = memoryview(buffer)
+    offset = HEADER.size
+    tiles = view[offset:offset + count * 2].cast('h')
+    offset += count * 2
+    passable = view[offset:offset + count]
+    offset += count
+    triggers = view[offset:offset + count]
+    offset += count
+    spawns = view[offset:offset + enemy_count * 4].cast('h')
+    offset += enemy_count * 4
+    enemy_spawns = [(spawns[i], spawns[i + 1]) for i in range(0, len(spawns), 2)]
+    cells = view[offset:offset + count * 2].cast('H')
+    offset += count * 2
+    atlas = frombytes(view[offset:].tobytes(), (atlas_count * TILE_SIZE, TILE_SIZE), 'RGB')
+    return MapData(width, height, (spawn_x, spawn_y), enemy_spawns, tiles, passable, triggers, cells, atlas)
+
+
+def save(tmx_path, free_tiles, trigger_tiles, map):  # Записывает кэш для загруженного объекта Map
+    sources = get_sources(tmx_path)
+    spawns = [coord for pos in map.enemy_spawns for coord in pos]
+    header = HEADER.pack(MAGIC, VERSION, map.width, map.height, TILE_SIZE, MAP_CHUNK_TILES, *map.spawn_pos,
+                         len(map.enemy_spawns), map.atlas.get_width() // TILE_SIZE, get_stamp(sources),
+                         get_crc(sources), get_signature(free_tiles, trigger_tiles))
+    cache_path = get_cache_path(tmx_path)
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, mode='wb') as file:
+            file.write(header)
+            file.write(struct.pack(f'<{len(map.tiles)}h', *map.tiles))
+            file.write(bytes(map.passable))
+            file.write(bytes(map.triggers))
+            file.write(struct.pack(f'<{len(spawns)}h', *spawns))
+            file.write(struct.pack(f'<{len(map.cells)}H', *map.cells))
+            file.write(tobytes(map.atlas, 'RGB'))
+        os.replace(temp_path, cache_path)  # Атомарная замена: читатель никогда не увидит половину файла
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
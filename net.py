@@ -0,0 +1,654 @@
+"""
+Сетевой режим: авторитетный сервер на asyncio и клиенты по локальному TCP.
+
+Сервер сам гоняет Game.step с фиксированным тиком TICK и раз в FPS // NET_SNAPSHOT_RATE тиков рассылает
+снимки состояния. Позиции в снимке квантуются до 1/NET_POSITION_SCALE пикселя, враги передаются только
+из зоны бодрствования камеры и дельтой к прошлому снимку, отправленному этому клиенту: изменившиеся
+и список исчезнувших. TCP доставляет всё по порядку, поэтому подтверждать базовый снимок не нужно.
+Клиент шлёт команду ввода каждый свой тик, а мир показывает с отставанием на NET_INTERP_SNAPSHOTS
+интервалов между снимками, интерполируя между двумя соседними. Прицел в команде - точка карты: камера
+клиента отстаёт от серверной, поэтому экранные координаты сервер понял бы со сдвигом.
+
+Герой в игре один: им управляет клиент, подключившийся первым, остальные смотрят (их команды
+принимаются и подтверждаются, но не применяются). Трафик и стоимость рассылки считаются по каждому клиенту.
+
+    python net.py server --seconds 600
+    python net.py client --render
+    python net.py bench --clients 8 --seconds 10   # сервер и безоконные клиенты в одном процессе, отчёт в JSON
+"""
+import sys
+import json
+import math
+import time
+import random
+import socket
+import struct
+import asyncio
+import argparse
+from collections import deque, namedtuple
+
+import main  # Раньше pygame: main.py прячет приветствие pygame
+import pygame
+from benchmark import percentiles
+from replay import DIFFICULTIES, clamp
+from constants import *
+
+FRAME = struct.Struct('<I')  # Длина сообщения, дальше само сообщение; первый байт - его тип
+MSG_HELLO, MSG_MAP, MSG_SNAPSHOT, MSG_INPUT = 1, 2, 3, 4
+HELLO = struct.Struct('<BHBBB')  # тип, id клиента, тиков в секунду, снимков в секунду, сложность
+MAP = struct.Struct('<BBHH')  # тип, номер карты, ширина и высота карты в пикселях
+# тип, номер команды, dx, dy, прицел x/y на карте (int16 хватает на карты до 1310 тайлов), флаги: выстрел,
+# прицел, слот оружия
+INPUT = struct.Struct('<BIbbhhB')
+# тип, тик, последняя принятая команда клиента, флаги, герой x/y, hp, патроны, оружие, убийства, угол героя
+SNAPSHOT = struct.Struct('<BIIBHHhhBHB')
+DELTA = struct.Struct('<HH')  # исчезнувших врагов (handle по 4 байта), изменившихся врагов (ENTITY)
+ENTITY = struct.Struct('<IHHh')  # handle, x, y, hp
+BULLETS = struct.Struct('<H')  # пуль (BULLET), пули передаются целиком: они движутся каждый тик
+BULLET = struct.Struct('<HHB')  # x, y, угол
+FLAG_WIN, FLAG_LOSE, FLAG_CONTROL = 1, 2, 4
+WEAPONS = (None, 'pistol', 'shotgun')
+
+# Снимок на клиенте. time - серверное время в секундах, hero - (x, y) в пикселях, angle - в градусах,
+# enemies - {handle: (x, y, hp)} в квантах, bullets - [(x, y, угол)] в квантах
+Snapshot = namedtuple('Snapshot', ['time', 'tick', 'map_number', 'flags', 'hero', 'angle', 'hp', 'ammo',
+                                   'weapon', 'kills', 'enemies', 'bullets'])
+# Интерполированное состояние для отрисовки и управления: позиции в пикселях, state - последний снимок
+View = namedtuple('View', ['hero', 'angle', 'enemies', 'bullets', 'state'])
+
+
+def quantize(value):  # Пиксели -> uint16 с шагом 1/NET_POSITION_SCALE
+    return max(0, min(0xFFFF, round(value * NET_POSITION_SCALE)))
+
+
+def quantize_angle(degrees):  # Градусы -> байт (256 шагов на оборот)
+    return round(degrees % 360 * 256 / 360) & 0xFF
+
+
+def lerp(a, b, t):
+    return a + (b - a) * t
+
+
+def lerp_angle(a, b, t):  # Углы-байты по кратчайшей дуге, результат в градусах
+    return (a + ((b - a + 128) % 256 - 128) * t) * 360 / 256
+
+
+async def read_message(reader):
+    size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return await reader.readexactly(size)
+
+
+def set_nodelay(writer):  # Снимки и команды маленькие, ждать их склейки (Nagle) нельзя
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def pack_command(seq, inputs):
+    flags = inputs.shoot | inputs.aim << 1 | inputs.weapon << 2
+    return INPUT.pack(MSG_INPUT, seq, inputs.dx, inputs.dy, clamp(inputs.target[0]), clamp(inputs.target[1]), flags)
+
+
+def unpack_command(payload):  # (номер команды, Inputs)
+    _, seq, dx, dy, x, y, flags = INPUT.unpack(payload)
+    return seq, main.Inputs(dx, dy, (x, y), bool(flags & 1), bool(flags & 2), flags >> 2)
+
+
+def encode_delta(baseline, state):  # Враги state относительно baseline (оба - {handle: (x, y, hp)})
+    removed = [handle for handle in baseline if handle not in state]
+    changed = [(handle, *value) for handle, value in state.items() if baseline.get(handle) != value]
+    parts = [DELTA.pack(len(removed), len(changed)), struct.pack(f'<{len(removed)}I', *removed)]
+    parts.extend(ENTITY.pack(*entity) for entity in changed)
+    return b''.join(parts)
+
+
+class Connection:
+    """
+    Подключённый клиент на стороне сервера: очередь его команд, базовое состояние для дельты
+    (то, что ему отправлено последним снимком) и счётчики трафика и времени кодирования.
+    """
+
+    def __init__(self, id, writer):
+        self.id = id
+        self.writer = writer
+        self.commands = deque()
+        self.ack = 0  # Номер последней принятой команды, возвращается клиенту в снимке
+        self.baseline = {}  # Пустая база - первый снимок уходит целиком
+        self.map = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.snapshots = 0
+        self.skipped = 0
+        self.received = 0
+        self.encode_time = 0.0
+        self.keyframe_bytes = 0
+        self.connected_at = time.perf_counter()
+
+    def send(self, payload):
+        self.writer.write(FRAME.pack(len(payload)) + payload)
+        self.bytes_out += FRAME.size + len(payload)
+
+    def is_congested(self):  # Клиент не успевает читать: новые снимки ему не отправляются, база не меняется
+        return self.writer.transport.get_write_buffer_size() > NET_MAX_PENDING_BYTES
+
+    def stats(self):
+        elapsed = max(time.perf_counter() - self.connected_at, 1e-9)
+        return {
+            'id': self.id,
+            'seconds': round(elapsed, 2),
+            'kbit_out_s': round(self.bytes_out * 8 / 1000 / elapsed, 2),
+            'kbit_in_s': round(self.bytes_in * 8 / 1000 / elapsed, 2),
+            'snapshots': self.snapshots,
+            'snapshots_skipped': self.skipped,
+            'snapshot_bytes_mean': round(self.bytes_out / self.snapshots, 1) if self.snapshots else None,
+            'keyframe_bytes': self.keyframe_bytes,
+            'commands': self.received,
+            'encode_ms_per_snapshot': round(self.encode_time / self.snapshots * 1000, 4) if self.snapshots else None,
+        }
+
+
+class Server:
+    """
+    Класс Server держит единственную игру (глобальное состояние main) и гоняет её с фиксированным тиком.
+    Команды клиентов копятся в их очередях и разбираются в начале тика. Дельты кодируются один раз
+    на базовое состояние: клиенты, получившие один и тот же прошлый снимок, получают одни и те же байты.
+    """
+
+    def __init__(self, map_number=1, difficulty='Easy', snapshot_rate=NET_SNAPSHOT_RATE, stats_every=NET_STATS_EVERY):
+        self.start_map = map_number
+        self.difficulty = difficulty
+        self.snapshot_every = max(1, FPS // snapshot_rate)
+        self.stats_every = stats_every  # None - не печатать статистику по ходу
+        self.connections = []  # В порядке подключения, первый управляет героем
+        self.finished = []  # Статистика отключившихся клиентов
+        self.next_id = 1
+        self.tick = 0
+        self.game = None
+        self.start_state = None
+        self.ended_at = None  # Тик победы или поражения
+        self.inputs = main.Inputs()
+        self.step_samples = deque(maxlen=PROFILE_WINDOW)
+        self.snapshot_samples = deque(maxlen=PROFILE_WINDOW)
+        self.server = None
+
+    def restart(self):  # Игра с начала стартовой карты: первый раз создаётся, дальше восстанавливается из снимка
+        if self.game is None:
+            main.set_difficulty(self.difficulty)
+            main.map_number = self.start_map
+            self.game = main.new_game()
+            self.start_state = self.game.checkpoint
+        else:
+            self.game.restore(self.start_state)
+        self.ended_at = None
+        self.inputs = main.Inputs()
+
+    async def start(self, host=NET_HOST, port=NET_PORT):  # Возвращает порт (при port=0 его выбирает система)
+        self.restart()
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        for connection in self.connections:
+            connection.writer.close()
+        for _ in range(FPS):  # Обработчики соединений сами переносят статистику в finished
+            if not self.connections:
+                break
+            await asyncio.sleep(TICK)
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):  # Одно соединение: приветствие, затем приём команд до отключения
+        set_nodelay(writer)
+        connection = Connection(self.next_id, writer)
+        self.next_id += 1
+        self.connections.append(connection)
+        connection.send(HELLO.pack(MSG_HELLO, connection.id, FPS, FPS // self.snapshot_every,
+                                   DIFFICULTIES.index(main.difficulty)))
+        try:
+            while True:
+                payload = await read_message(reader)
+                connection.bytes_in += FRAME.size + len(payload)
+                if payload[0] == MSG_INPUT:
+                    connection.commands.append(unpack_command(payload))
+                    connection.received += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.remove(connection)
+            self.finished.append(connection.stats())
+            writer.close()
+
+    def collect_inputs(self):  # Ввод тика: последняя команда управляющего клиента, клики из всех пришедших.
+        inputs = self.inputs._replace(shoot=False, aim=False)  # Если команд нет, герой идёт как шёл
+        for index, connection in enumerate(self.connections):
+            while connection.commands:
+                connection.ack, command = connection.commands.popleft()
+                if index == 0:
+                    inputs = command._replace(shoot=inputs.shoot or command.shoot, aim=inputs.aim != command.aim)
+        self.inputs = inputs
+        return inputs
+
+    def update(self):  # Один тик сервера
+        inputs = self.collect_inputs()
+        start = time.perf_counter()
+        self.game.step(inputs, TICK, world=True)
+        self.step_samples.append(time.perf_counter() - start)
+        self.tick += 1
+        if main.win or main.lose:
+            if self.ended_at is None:
+                self.ended_at = self.tick
+            elif self.tick - self.ended_at >= NET_RESTART_DELAY * FPS:
+                self.restart()
+        if self.tick % self.snapshot_every == 0 and self.connections:
+            self.broadcast()
+
+    def capture(self):  # Квантованные враги в зоне бодрствования камеры: {handle: (x, y, hp)}
+        awake = self.game.camera.awake
+        x, y, hp = main.enemies.x, main.enemies.y, main.enemies.hp
+        return {enemy.handle: (quantize(x[slot]), quantize(y[slot]), hp[slot])
+                for slot, enemy in enumerate(main.enemies.objects) if awake.collidepoint(x[slot], y[slot])}
+
+    def pack_bullets(self):
+        bullets = main.bullets
+        parts = [BULLETS.pack(len(bullets.active))]
+        parts.extend(BULLET.pack(quantize(bullets.x[slot]), quantize(bullets.y[slot]),
+                                 quantize_angle(bullets.angle[slot])) for slot in bullets.active)
+        return b''.join(parts)
+
+    def pack_hero(self):  # Поля SNAPSHOT от позиции героя до угла
+        hero = self.game.hero
+        x, y = hero.get_pixel_pos()
+        angle = math.degrees(math.atan2(x - hero.target[0], y - hero.target[1]))  # Как в Hero.rotate
+        return (quantize(x), quantize(y), hero.hp, hero.ammo, WEAPONS.index(hero.weapon), main.kills,
+                quantize_angle(angle))
+
+    def broadcast(self):  # Снимок всем клиентам, кроме не успевающих читать
+        start = time.perf_counter()
+        state = self.capture()
+        bullets = self.pack_bullets()
+        hero = self.pack_hero()
+        flags = FLAG_WIN * main.win | FLAG_LOSE * main.lose
+        map = self.game.map
+        deltas = {}  # id(базы) -> тело снимка
+        for index, connection in enumerate(self.connections):
+            if connection.is_congested():
+                connection.skipped += 1
+                continue
+            begin = time.perf_counter()
+            if connection.map is not map:
+                connection.send(MAP.pack(MSG_MAP, main.map_number, *map.pixel_size))
+                connection.map = map
+            body = deltas.get(id(connection.baseline))
+            if body is None:
+                body = deltas[id(connection.baseline)] = encode_delta(connection.baseline, state) + bullets
+            header = SNAPSHOT.pack(MSG_SNAPSHOT, self.tick, connection.ack,
+                                   flags | (FLAG_CONTROL if index == 0 else 0), *hero)
+            if not connection.snapshots:
+                connection.keyframe_bytes = FRAME.size + len(header) + len(body)
+            connection.send(header + body)
+            connection.baseline = state
+            connection.snapshots += 1
+            connection.encode_time += time.perf_counter() - begin
+        self.snapshot_samples.append(time.perf_counter() - start)
+
+    async def run(self, seconds=None):  # Фиксированный тик по часам цикла событий, отставание не догоняется
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        end = None if seconds is None else next_tick + seconds
+        report_at = next_tick + (self.stats_every or 0)
+        while end is None or loop.time() < end:
+            steps = 0
+            while loop.time() >= next_tick and steps < MAX_STEPS_PER_FRAME:
+                self.update()
+                next_tick += TICK
+                steps += 1
+            if steps == MAX_STEPS_PER_FRAME:
+                next_tick = loop.time()
+            if self.stats_every and loop.time() >= report_at:
+                report_at += self.stats_every
+                print(json.dumps(self.summary()))
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    def summary(self):  # Короткая строка статистики по ходу работы
+        step = percentiles(self.step_samples) if self.step_samples else None
+        return {
+            'tick': self.tick,
+            'map': main.map_number,
+            'enemies': len(main.enemies),
+            'step_ms_p95': round(step['p95'], 3) if step else None,
+            'clients': {connection.id: connection.stats()['kbit_out_s'] for connection in self.connections},
+        }
+
+    def stats(self):
+        return {
+            'ticks': self.tick,
+            'snapshot_every_ticks': self.snapshot_every,
+            'step_ms': percentiles(self.step_samples) if self.step_samples else None,
+            'broadcast_ms': percentiles(self.snapshot_samples) if self.snapshot_samples else None,
+            'clients': [connection.stats() for connection in self.connections] + self.finished,
+        }
+
+
+class Client:
+    """
+    Класс Client принимает снимки, восстанавливает из дельт полное состояние и хранит буфер последних
+    NET_SNAPSHOT_BUFFER снимков. sample отдаёт состояние на момент "сейчас минус задержка интерполяции":
+    между двумя снимками позиции интерполируются, если следующий снимок опаздывает, держится последний.
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self.id = 0
+        self.tick_rate = FPS
+        self.snapshot_rate = NET_SNAPSHOT_RATE
+        self.interp_delay = NET_INTERP_SNAPSHOTS / NET_SNAPSHOT_RATE
+        self.difficulty = 'Easy'
+        self.map_number = 0
+        self.world_size = WINDOW_SIZE
+        self.enemies = {}  # Состояние врагов по последнему снимку, база для следующей дельты
+        self.snapshots = deque(maxlen=NET_SNAPSHOT_BUFFER)
+        self.clock_offset = None  # Локальное время минус серверное, наименьшее из увиденных
+        self.seq = 0
+        self.pending = deque(maxlen=FPS * 10)  # (номер команды, время отправки) до подтверждения
+        self.ack_samples = deque(maxlen=PROFILE_WINDOW)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.received = 0
+        self.samples = 0
+        self.held = 0  # Сэмплов, когда следующий снимок ещё не пришёл
+        self.connected_at = 0.0
+
+    async def connect(self, host=NET_HOST, port=NET_PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        set_nodelay(self.writer)
+        payload = await read_message(self.reader)
+        self.bytes_in += FRAME.size + len(payload)
+        _, self.id, self.tick_rate, self.snapshot_rate, difficulty = HELLO.unpack(payload)
+        self.difficulty = DIFFICULTIES[difficulty]
+        self.interp_delay = NET_INTERP_SNAPSHOTS / self.snapshot_rate
+        self.connected = True
+        self.connected_at = time.perf_counter()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.connected = False
+
+    async def receive(self):  # Читает сообщения сервера до отключения
+        try:
+            while True:
+                payload = await read_message(self.reader)
+                self.bytes_in += FRAME.size + len(payload)
+                if payload[0] == MSG_SNAPSHOT:
+                    self.apply_snapshot(payload)
+                elif payload[0] == MSG_MAP:
+                    _, self.map_number, width, height = MAP.unpack(payload)
+                    self.world_size = width, height
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        self.connected = False
+
+    def apply_snapshot(self, payload):
+        _, tick, ack, flags, x, y, hp, ammo, weapon, kills, angle = SNAPSHOT.unpack_from(payload)
+        offset = SNAPSHOT.size
+        removed, changed = DELTA.unpack_from(payload, offset)
+        offset += DELTA.size
+        enemies = dict(self.enemies)  # Старый словарь остаётся в буфере снимков
+        for handle in struct.unpack_from(f'<{removed}I', payload, offset):
+            enemies.pop(handle, None)
+        offset += removed * 4
+        for handle, enemy_x, enemy_y, enemy_hp in ENTITY.iter_unpack(payload[offset:offset + changed * ENTITY.size]):
+            enemies[handle] = enemy_x, enemy_y, enemy_hp
+        offset += changed * ENTITY.size
+        count, = BULLETS.unpack_from(payload, offset)
+        offset += BULLETS.size
+        bullets = list(BULLET.iter_unpack(payload[offset:offset + count * BULLET.size]))
+        self.enemies = enemies
+        self.received += 1
+
+        now = time.perf_counter()
+        server_time = tick / self.tick_rate
+        if self.clock_offset is None or now - server_time < self.clock_offset:
+            self.clock_offset = now - server_time
+        while self.pending and self.pending[0][0] <= ack:
+            seq, sent = self.pending.popleft()
+            if seq == ack:
+                self.ack_samples.append(now - sent)
+        self.snapshots.append(Snapshot(server_time, tick, self.map_number, flags,
+                                       (x / NET_POSITION_SCALE, y / NET_POSITION_SCALE), angle, hp, ammo,
+                                       WEAPONS[weapon], kills, enemies, bullets))
+
+    def send(self, inputs):
+        self.seq += 1
+        payload = pack_command(self.seq, inputs)
+        self.writer.write(FRAME.pack(len(payload)) + payload)
+        self.bytes_out += FRAME.size + len(payload)
+        self.pending.append((self.seq, time.perf_counter()))
+
+    def sample(self, now):  # View на момент now (time.perf_counter) минус задержка интерполяции, None до снимков
+        if not self.snapshots:
+            return None
+        self.samples += 1
+        render_time = now - self.clock_offset - self.interp_delay
+        older = newer = self.snapshots[-1]
+        if render_time >= newer.time:
+            self.held += 1  # Без экстраполяции: лучше постоять, чем дёрнуться назад
+        else:
+            for snapshot in reversed(self.snapshots):
+                older = snapshot
+                if snapshot.time <= render_time:
+                    break
+                newer = snapshot
+        if older.map_number != newer.map_number:
+            older = newer  # Смена карты: интерполировать между картами нечего
+        t = 0.0 if older is newer else (render_time - older.time) / (newer.time - older.time)
+        hero = lerp(older.hero[0], newer.hero[0], t), lerp(older.hero[1], newer.hero[1], t)
+        enemies = []
+        for handle, (x, y, hp) in older.enemies.items():
+            x1, y1, _ = newer.enemies.get(handle, (x, y, hp))
+            enemies.append((lerp(x, x1, t) / NET_POSITION_SCALE, lerp(y, y1, t) / NET_POSITION_SCALE, hp))
+        bullets = [(x / NET_POSITION_SCALE, y / NET_POSITION_SCALE, angle * 360 / 256)
+                   for x, y, angle in older.bullets]
+        return View(hero, lerp_angle(older.angle, newer.angle, t), enemies, bullets, self.snapshots[-1])
+
+    def stats(self):
+        elapsed = max(time.perf_counter() - self.connected_at, 1e-9)
+        return {
+            'id': self.id,
+            'snapshots': self.received,
+            'kbit_in_s': round(self.bytes_in * 8 / 1000 / elapsed, 2),
+            'kbit_out_s': round(self.bytes_out * 8 / 1000 / elapsed, 2),
+            'interp_delay_ms': round(self.interp_delay * 1000, 1),
+            'held_ratio': round(self.held / self.samples, 4) if self.samples else None,
+            'input_ack_ms': percentiles(self.ack_samples) if self.ack_samples else None,
+        }
+
+
+class WanderPolicy:
+    """
+    Поведение безоконного клиента: раз в turn_every тиков меняет направление и стреляет
+    в ближайшего видимого врага. Видит только то, что пришло в снимках.
+    """
+
+    def __init__(self, rng, turn_every=30, shoot_every=15):
+        self.rng = rng
+        self.turn_every = turn_every
+        self.shoot_every = shoot_every
+        self.direction = (0, 0)
+
+    def __call__(self, view, tick):
+        if tick % self.turn_every == 0:
+            self.direction = self.rng.randint(-1, 1), self.rng.randint(-1, 1)
+        hero_x, hero_y = view.hero
+        target = hero_x + self.direction[0] * TILE_SIZE, hero_y + self.direction[1] * TILE_SIZE
+        if view.enemies:
+            x, y, _ = min(view.enemies, key=lambda enemy: (enemy[0] - hero_x) ** 2 + (enemy[1] - hero_y) ** 2)
+            target = x + TILE_SIZE // 2, y + TILE_SIZE // 2
+        weapon = 0 if view.state.weapon or tick % self.turn_every else 1
+        return main.Inputs(*self.direction, target, tick % self.shoot_every == 0, weapon=weapon)
+
+
+def follow(camera, client, view):
+    camera.follow((view.hero[0] + TILE_SIZE // 2, view.hero[1] + TILE_SIZE // 2), client.world_size)
+
+
+async def run_headless_client(host, port, seconds, seed=0):  # Клиент без окна, возвращает его статистику
+    client = Client()
+    await client.connect(host, port)
+    receiver = asyncio.create_task(client.receive())
+    policy = WanderPolicy(random.Random(seed))
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    end = next_tick + seconds
+    tick = 0
+    while client.connected and loop.time() < end:
+        view = client.sample(time.perf_counter())
+        if view is not None:
+            client.send(policy(view, tick))
+        tick += 1
+        next_tick += TICK
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+    client.close()
+    receiver.cancel()
+    return client.stats()
+
+
+def draw(screen, map, camera, client, view):  # Кадр клиента по интерполированному состоянию
+    offset = camera.rect.topleft
+    screen.fill(BLACK)
+    map.render(screen, offset)
+    enemy_image = main.assets.load('enemy_cultist.png')
+    hp_scale = 2 if client.difficulty == 'Hard' else 1
+    for x, y, hp in view.enemies:
+        x, y = camera.to_screen((x, y))
+        screen.blit(enemy_image, (x, y))
+        pygame.draw.rect(screen, RED, (x, y - 6, ENEMY_HP, 5))
+        if hp > 0:
+            pygame.draw.rect(screen, GREEN, (x, y - 6, hp // hp_scale, 5))
+    screen.blit(main.assets.rotated('hero.png', view.angle), camera.to_screen(view.hero))
+    for x, y, angle in view.bullets:
+        image = main.assets.rotated('bullet', angle)
+        screen.blit(image, image.get_rect(center=camera.to_screen((x, y))))
+    state = view.state
+    screen.blit(main.render_text(f'Ammo: {state.ammo}   Kills: {state.kills}', 40, YELLOW), (20, 20))
+    if not state.flags & FLAG_CONTROL:
+        screen.blit(main.render_text('Spectator', 40, WHITE), (20, 60))
+    if state.flags & (FLAG_WIN | FLAG_LOSE):
+        text = main.render_text('Victory!' if state.flags & FLAG_WIN else 'Defeat', 200,
+                                GREEN if state.flags & FLAG_WIN else RED)
+        screen.blit(text, text.get_rect(center=screen.get_rect().center))
+
+
+async def run_rendered_client(host, port, seconds=None):  # Клиент с окном: мышь и клавиатура как в main
+    main.init_pygame()
+    screen = pygame.display.set_mode(WINDOW_SIZE)
+    pygame.display.set_caption('Hot Rooms - client')
+    client = Client()
+    await client.connect(host, port)
+    receiver = asyncio.create_task(client.receive())
+    camera = main.Camera()
+    map, map_number = None, 0
+    loop = asyncio.get_running_loop()
+    next_frame = loop.time()
+    end = None if seconds is None else next_frame + seconds
+    while client.connected and (end is None or loop.time() < end):
+        events = pygame.event.get()
+        if any(event.type == pygame.QUIT or event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE
+               for event in events):
+            break
+        view = client.sample(time.perf_counter())
+        if view is not None:
+            if map_number != view.state.map_number:
+                map_number = view.state.map_number
+                map = main.levels.get(f'map{map_number}.tmx')  # Карты у клиента свои, с диска
+            follow(camera, client, view)
+            draw(screen, map, camera, client, view)
+            inputs = main.read_inputs(events)
+            client.send(inputs._replace(target=camera.to_world(inputs.target)))
+        pygame.display.flip()
+        next_frame += TICK
+        await asyncio.sleep(max(0.0, next_frame - loop.time()))
+    client.close()
+    receiver.cancel()
+    return client.stats()
+
+
+async def serve(args):
+    main.init_headless(WINDOW_SIZE)
+    main.verbose = False
+    server = Server(args.map, args.difficulty, args.snapshot_rate)
+    port = await server.start(args.host, args.port)
+    print(f'Listening on {args.host}:{port}')
+    try:
+        await server.run(args.seconds)
+    finally:
+        await server.close()
+    return server.stats()
+
+
+async def bench(args):  # Сервер и args.clients безоконных клиентов в одном процессе на localhost
+    main.init_headless(WINDOW_SIZE)
+    main.verbose = False
+    server = Server(args.map, args.difficulty, args.snapshot_rate, stats_every=None)
+    port = await server.start(args.host, 0)
+    server_task = asyncio.create_task(server.run())
+    begin = time.perf_counter()
+    clients = await asyncio.gather(*(run_headless_client(args.host, port, args.seconds, args.seed + i)
+                                     for i in range(args.clients)))
+    wall = time.perf_counter() - begin
+    server_task.cancel()
+    await server.close()
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'clients': args.clients,
+            'seconds': args.seconds,
+            'wall_s': round(wall, 3),
+            'snapshot_rate': args.snapshot_rate,
+            'position_scale': NET_POSITION_SCALE,
+            'map': args.map,
+            'difficulty': args.difficulty,
+        },
+        'server': server.stats(),
+        'clients': clients,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Hot Rooms network mode')
+    parser.add_argument('mode', choices=('server', 'client', 'bench'))
+    parser.add_argument('--host', default=NET_HOST)
+    parser.add_argument('--port', type=int, default=NET_PORT)
+    parser.add_argument('--seconds', type=float, default=None, help='время работы (по умолчанию без ограничения, '
+                                                                  'в bench - 10 секунд)')
+    parser.add_argument('--map', type=int, default=1, help='стартовая карта сервера')
+    parser.add_argument('--difficulty', choices=DIFFICULTIES, default='Easy')
+    parser.add_argument('--snapshot-rate', type=int, default=NET_SNAPSHOT_RATE, help='снимков в секунду')
+    parser.add_argument('--render', action='store_true', help='клиент с окном (иначе безоконный бот)')
+    parser.add_argument('--clients', type=int, default=4, help='клиентов в bench')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.mode == 'server':
+        report = asyncio.run(serve(args))
+    elif args.mode == 'bench':
+        args.seconds = args.seconds or 10
+        report = asyncio.run(bench(args))
+    elif args.render:
+        report = asyncio.run(run_rendered_client(args.host, args.port, args.seconds))
+    else:
+        main.init_headless(WINDOW_SIZE)
+        report = asyncio.run(run_headless_client(args.host, args.port, args.seconds or math.inf, args.seed))
+    if args.output:
+        with open(args.output, mode='w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    main.levels.shutdown()
+    pygame.quit()
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+from collections import Counter, deque
+
+import pygame
+
+from constants import *
+
+
+class PhaseTimer:
+    """
+    Класс PhaseTimer - контекстный менеджер для замера одной фазы кадра. Создаётся один раз на фазу
+    и переиспользуется, чтобы замеры сами не создавали мусор каждый кадр.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        phases = self.profiler.phases
+        phases[self.name] = phases.get(self.name, 0) + time.perf_counter() - self.start
+        return False
+
+
+class FrameProfiler:
+    """
+    Класс FrameProfiler замеряет время фаз каждого кадра и считает выделения (созданные пули, шрифты,
+    поверхности). Хранит окно последних кадров для p50/p95/p99, помечает долгие кадры с самой дорогой
+    фазой и пишет всё это в JSONL-лог с ротацией. Оверлей со сводкой включается клавишей F3.
+    Подсистемы со своими метриками (например, планировщик ИИ) добавляют их в сводку через add_source.
+    """
+
+    def __init__(self, log_path=PROFILE_LOG, window=PROFILE_WINDOW, long_frame_ms=LONG_FRAME_MS):
+        self.log_path = log_path
+        self.long_frame_ms = long_frame_ms
+        self.frames = deque(maxlen=window)  # Длительности последних кадров, мс
+        self.phase_totals = Counter()
+        self.counter_totals = Counter()
+        self.timers = {}
+        self.phases = {}
+        self.counters = Counter()
+        self.sources = {}  # Имя -> функция, возвращающая словарь метрик для сводки
+        self.frame = 0
+        self.frame_start = time.perf_counter()
+        self.overlay = False
+        self.overlay_surface = None
+        self.overlay_scaled = None  # Оверлей в масштабе кадра, как у Hud: содержимое меняется, поэтому кэш свой
+        self.font = None
+        self.log_file = None
+
+    def phase(self, name):  # with profiler.phase('map'): ...
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = PhaseTimer(self, name)
+        return timer
+
+    def add_source(self, name, metrics):  # Повторная регистрация под тем же именем заменяет прежнюю
+        self.sources[name] = metrics
+
+    def count(self, name, n=1):
+        if n:
+            self.counters[name] += n
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+        self.phases = {}
+        self.counters = Counter()
+
+    def end_frame(self):
+        frame_ms = (time.perf_counter() - self.frame_start) * 1000
+        self.frame += 1
+        self.frames.append(frame_ms)
+        self.phase_totals.update(self.phases)
+        self.counter_totals.update(self.counters)
+        if frame_ms > self.long_frame_ms:
+            cause = max(self.phases, key=self.phases.get) if self.phases else 'other'
+            self.write({'type': 'long_frame', 'frame': self.frame, 'ms': round(frame_ms, 3), 'cause': cause,
+                        'phases_ms': self.get_phases_ms(self.phases, 1), 'counters': dict(self.counters)})
+        if self.frame % PROFILE_SUMMARY_EVERY == 0:
+            self.write(self.summary())
+            self.phase_totals.clear()
+            self.counter_totals.clear()
+
+    def get_phases_ms(self, phases, frames):
+        return {name: round(seconds * 1000 / frames, 3) for name, seconds in phases.items()}
+
+    def get_percentile(self, q):
+        frames = sorted(self.frames)
+        if not frames:
+            return 0
+        return frames[min(len(frames) - 1, int(q * len(frames)))]
+
+    def summary(self):  # Сводка за последние PROFILE_SUMMARY_EVERY кадров
+        frames = self.frame % PROFILE_SUMMARY_EVERY or PROFILE_SUMMARY_EVERY
+        return {
+            'type': 'summary',
+            'frame': self.frame,
+            'p50': round(self.get_percentile(0.50), 3),
+            'p95': round(self.get_percentile(0.95), 3),
+            'p99': round(self.get_percentile(0.99), 3),
+            'phases_ms': self.get_phases_ms(self.phase_totals, frames),
+            'counters': dict(self.counter_totals),
+            **{name: metrics() for name, metrics in self.sources.items()},
+        }
+
+    def write(self, record):  # Строка в JSONL-лог. Когда файл вырастает больше PROFILE_LOG_MAX_BYTES, он ротируется
+        if not self.log_path:
+            return
+        if self.log_file is None:
+            self.log_file = open(self.log_path, mode='a')
+        self.log_file.write(json.dumps(record) + '\n')
+        if self.log_file.tell() > PROFILE_LOG_MAX_BYTES:
+            self.log_file.close()
+            os.replace(self.log_path, self.log_path + '.1')
+            self.log_file = open(self.log_path, mode='a')
+
+    def close(self):
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.overlay_surface = None
+
+    def render(self, screen, scale=1.0):  # Оверлей: перцентили кадра, фазы и счётчики в масштабе кадра scale
+        if not self.overlay:
+            return None
+        if self.overlay_surface is None or self.frame % 15 == 0:
+            self.overlay_scaled = None
+            if self.font is None:
+                self.font = pygame.font.Font(None, 20)
+            lines = [f'frame p50 {self.get_percentile(0.50):.2f}  p95 {self.get_percentile(0.95):.2f}  '
+                     f'p99 {self.get_percentile(0.99):.2f} ms']
+            lines += [f'{name}: {seconds * 1000:.2f} ms' for name, seconds in self.phases.items()]
+            lines += [f'{name}: {n}' for name, n in self.counters.items()]
+            self.overlay_surface = pygame.Surface((320, 16 * len(lines) + 8))
+            self.overlay_surface.set_alpha(200)
+            for i, line in enumerate(lines):
+                self.overlay_surface.blit(self.font.render(line, True, YELLOW), (4, 4 + 16 * i))
+        if scale == 1:
+            return screen.blit(self.overlay_surface, (0, 0))
+        if self.overlay_scaled is None or self.overlay_scaled[0] != scale:
+            width, height = self.overlay_surface.get_size()
+            surface = pygame.transform.scale(self.overlay_surface, (round(width * scale), round(height * scale)))
+            surface.set_alpha(200)
+            self.overlay_scaled = scale, surface
+        return screen.blit(self.overlay_scaled[1], (0, 0))
@@ -0,0 +1,187 @@
+"""
+Запись и воспроизведение сессий. Во время игры (python main.py --record session.hrr) в файл пишется
+заголовок с сидом случайных чисел, стартовой картой и сложностью, а затем ввод каждого тика Game.step.
+Одинаковые подряд тики сжимаются в одну запись со счётчиком повторов, в конце пишется итог сессии
+для проверки, что повтор сошёлся с оригиналом.
+
+Повтор без окна так быстро, как позволяет процессор, с замерами каждого тика и логом профайлера:
+    python replay.py session.hrr --profile-log replay_profile.jsonl
+Повтор с отрисовкой в обычном темпе (или быстрее, --speed 4):
+    python replay.py session.hrr --render
+"""
+import sys
+import json
+import time
+import random
+import struct
+import argparse
+from collections import namedtuple
+
+import main  # Раньше pygame: main.py прячет приветствие pygame
+import pygame
+from benchmark import percentiles
+from constants import *
+
+MAGIC = b'HRRP'
+VERSION = 1
+HEADER = struct.Struct('<4sHIBB')  # magic, версия, сид, стартовая карта, сложность (0 - Easy, 1 - Hard)
+RECORD = struct.Struct('<HbbhhB')  # повторов, dx, dy, прицел x/y, флаги: выстрел, прицел, слот оружия
+TRAILER = struct.Struct('<Iidd')  # тиков, убийств, позиция героя x/y
+DIFFICULTIES = ('Easy', 'Hard')
+
+Replay = namedtuple('Replay', ['seed', 'map_number', 'difficulty', 'ticks', 'result'])
+
+
+def clamp(value):  # Координаты прицела в int16
+    return max(-32768, min(32767, int(value)))
+
+
+def pack_inputs(inputs, repeat):
+    flags = inputs.shoot | inputs.aim << 1 | inputs.weapon << 2
+    return RECORD.pack(repeat, inputs.dx, inputs.dy, clamp(inputs.target[0]), clamp(inputs.target[1]), flags)
+
+
+def unpack_inputs(buffer, offset):  # (повторов, Inputs)
+    repeat, dx, dy, x, y, flags = RECORD.unpack_from(buffer, offset)
+    return repeat, main.Inputs(dx, dy, (x, y), bool(flags & 1), bool(flags & 2), flags >> 2)
+
+
+class InputRecorder:
+    """
+    Класс InputRecorder пишет ввод по тикам. Текущая серия одинаковых тиков копится в памяти и уходит
+    в файл одной записью, когда ввод меняется или серия упирается в предел счётчика.
+    """
+
+    def __init__(self, path, seed, map_number, difficulty):
+        self.file = open(path, mode='wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, map_number, DIFFICULTIES.index(difficulty)))
+        self.last = None
+        self.repeat = 0
+        self.ticks = 0
+
+    def write(self, inputs):  # Вызывается перед каждым Game.step
+        self.ticks += 1
+        if inputs == self.last and self.repeat < 0xFFFF:
+            self.repeat += 1
+            return
+        self.flush()
+        self.last = inputs
+        self.repeat = 1
+
+    def flush(self):
+        if self.repeat:
+            self.file.write(pack_inputs(self.last, self.repeat))
+            self.repeat = 0
+
+    def close(self, game):  # Итог сессии: по нему повтор проверяет, что пришёл в то же состояние
+        self.flush()
+        self.file.write(RECORD.pack(0, 0, 0, 0, 0, 0))
+        self.file.write(TRAILER.pack(self.ticks, main.kills, *game.hero.get_pixel_pos()))
+        self.file.close()
+
+
+def load(path):  # Replay и генератор Inputs по тикам. result - None, если запись оборвалась без итога
+    with open(path, mode='rb') as file:
+        buffer = file.read()
+    magic, version, seed, map_number, difficulty = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{path}: not a Hot Rooms replay (version {VERSION})')
+    records = []
+    ticks = 0
+    result = None
+    offset = HEADER.size
+    while offset + RECORD.size <= len(buffer):
+        repeat, inputs = unpack_inputs(buffer, offset)
+        offset += RECORD.size
+        if repeat == 0:
+            if offset + TRAILER.size <= len(buffer):
+                result = TRAILER.unpack_from(buffer, offset)
+            break
+        records.append((repeat, inputs))
+        ticks += repeat
+
+    def inputs():
+        for repeat, tick_inputs in records:
+            for _ in range(repeat):
+                yield tick_inputs
+
+    return Replay(seed, map_number, DIFFICULTIES[difficulty], ticks, result), inputs()
+
+
+def start(replay):  # Игра в том же состоянии, в каком началась записанная сессия
+    main.verbose = False
+    main.set_difficulty(replay.difficulty)
+    main.map_number = replay.map_number
+    random.seed(replay.seed)
+    return main.new_game(deterministic=True)
+
+
+def check(replay, game, ticks):  # Совпал ли повтор с итогом записи (None, если итога нет)
+    if replay.result is None:
+        return None
+    return replay.result == (ticks, main.kills, *game.hero.get_pixel_pos())
+
+
+def run_headless(replay, inputs):
+    main.init_headless(WINDOW_SIZE)
+    game = start(replay)
+    samples = []
+    begin = time.perf_counter()
+    for tick_inputs in inputs:
+        main.profiler.begin_frame()
+        game.step(tick_inputs, TICK)
+        main.profiler.end_frame()
+        samples.append(main.profiler.frames[-1] / 1000)
+    wall = time.perf_counter() - begin
+    return {
+        'ticks': len(samples),
+        'game_time_s': round(len(samples) * TICK, 3),
+        'wall_s': round(wall, 3),
+        'speedup': round(len(samples) * TICK / wall, 1) if wall else None,
+        'step_ms': percentiles(samples) if samples else None,
+        'deterministic': check(replay, game, len(samples)),
+    }
+
+
+def run_rendered(replay, inputs, speed=1):
+    main.init_pygame()
+    screen = pygame.display.set_mode(WINDOW_SIZE)
+    pygame.display.set_caption('Hot Rooms - replay')
+    clock = pygame.time.Clock()
+    game = start(replay)
+    ticks = 0
+    for tick_inputs in inputs:
+        if any(event.type == pygame.QUIT for event in pygame.event.get()):
+            break
+        main.profiler.begin_frame()
+        game.step(tick_inputs, TICK)
+        game.render(screen)
+        pygame.display.flip()
+        main.profiler.end_frame()
+        ticks += 1
+        clock.tick(FPS * speed)
+    return {'ticks': ticks, 'deterministic': check(replay, game, ticks)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Hot Rooms replay')
+    parser.add_argument('path')
+    parser.add_argument('--render', action='store_true', help='показывать повтор в окне')
+    parser.add_argument('--speed', type=float, default=1, help='скорость повтора с --render')
+    parser.add_argument('--profile-log', default=None, help='JSONL-лог профайлера (по умолчанию не пишется)')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main.profiler.log_path = args.profile_log
+    replay, inputs = load(args.path)
+    if args.render:
+        report = run_rendered(replay, inputs, args.speed)
+    else:
+        report = run_headless(replay, inputs)
+    report.update(seed=replay.seed, map=replay.map_number, difficulty=replay.difficulty)
+    json.dump(report, sys.stdout, indent=2)
+    main.profiler.close()
+    main.levels.shutdown()
+    pygame.quit()
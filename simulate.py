@@ -0,0 +1,315 @@
+"""
+Пакетная симуляция раундов для баланса и подбора сложности. Раунды (карта x сложность x политика x сид)
+раздаются пулу процессов, каждый процесс гоняет игру без окна через Game.step так быстро, как может.
+Раунд заканчивается уходом с карты или победой (win), смертью героя (lose) или по лимиту тиков (timeout).
+Результаты сводятся по карте, сложности и политике и печатаются в JSON.
+
+Константы из constants.py можно подменить на время прогона, не трогая файл:
+    python simulate.py --rounds 50 --policies scripted random --set ENEMY_HP=150 SHOTGUN_DAMAGE=40
+"""
+import os
+import sys
+import ast
+import json
+import time
+import random
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import constants
+import main
+from constants import *
+
+DIFFICULTIES = ('Easy', 'Hard')
+EXIT_TILES = (8, 13)  # Смена карты и победа
+WEAPON_TILES = {7: 'pistol', 23: 'shotgun'}  # Тайлы подбора оружия, как в Game.check_triggers
+arrival_weapons_cache = {}
+
+
+def apply_overrides(overrides):  # {'ENEMY_HP': 150, ...} -> constants и глобальные переменные main
+    for name, value in overrides.items():
+        if not hasattr(constants, name):
+            raise KeyError(f'Unknown constant {name}')
+        setattr(constants, name, value)
+        setattr(main, name, value)
+    if 'ENEMY_DELAY' in overrides and 'ENEMY_SPEED' not in overrides:  # Скорость врагов выводится из задержки
+        speed = TILE_SIZE / overrides['ENEMY_DELAY'] * 1000 / FPS
+        constants.ENEMY_SPEED = main.ENEMY_SPEED = speed
+
+
+def init_worker(overrides):  # Выполняется один раз в каждом процессе пула
+    main.verbose = False
+    main.profiler.log_path = None
+    main.init_headless(WINDOW_SIZE)
+    apply_overrides(overrides)
+
+
+def build_goal_field(map, goal_tiles):  # BFS от всех тайлов цели: расстояние до ближайшей цели для каждого тайла
+    width, height = map.width, map.height
+    distance = [-1] * (width * height)
+    queue = deque()
+    for i, tile_id in enumerate(map.tiles):
+        if tile_id in goal_tiles:
+            distance[i] = 0
+            queue.append(i)
+    while queue:
+        i = queue.popleft()
+        x = i % width
+        for j, inside in (i + width, i + width < width * height), (i + 1, x + 1 < width), \
+                (i - 1, x > 0), (i - width, i >= width):
+            if inside and distance[j] == -1 and (map.passable[j] or map.tiles[j] in goal_tiles):
+                distance[j] = distance[i] + 1
+                queue.append(j)
+    return distance
+
+
+def nearest_enemy(hero_x, hero_y):  # Центр ближайшего врага и квадрат расстояния до него, None если врагов нет
+    xs, ys = main.enemies.x, main.enemies.y
+    best, best_distance = None, None
+    for slot in range(len(xs)):
+        distance = (xs[slot] - hero_x) ** 2 + (ys[slot] - hero_y) ** 2
+        if best_distance is None or distance < best_distance:
+            best, best_distance = (xs[slot] + TILE_SIZE // 2, ys[slot] + TILE_SIZE // 2), distance
+    return best, best_distance
+
+
+class ScriptedPolicy:
+    """
+    Политика "как играл бы аккуратный игрок": сначала собирает ещё не взятое оружие на карте, потом идёт
+    к ближайшему выходу по кратчайшему пути, стреляет в ближайшего врага в радиусе видимости, дробовик берёт,
+    когда враг близко.
+    """
+
+    def __init__(self, game, rng, cooldown=12, sight=12 * TILE_SIZE, shotgun_range=4 * TILE_SIZE):
+        self.rng = rng
+        self.cooldown = cooldown
+        self.sight = sight
+        self.shotgun_range = shotgun_range
+        self.pickups = {tile_id: WEAPON_TILES[tile_id] for tile_id in set(game.map.tiles) if tile_id in WEAPON_TILES}
+        self.goals = None
+        self.goal_field = None
+        self.next_shot = 0
+
+    def update_goals(self, map):  # Цель - ещё не взятое оружие, когда его не осталось - выход
+        goals = tuple(sorted(tile_id for tile_id, name in self.pickups.items() if name not in main.weapons))
+        goals = goals or EXIT_TILES
+        if goals != self.goals:
+            self.goals = goals
+            self.goal_field = build_goal_field(map, goals)
+
+    def next_tile(self, map, pos):
+        self.update_goals(map)
+        width, distance = map.width, self.goal_field
+        best, best_distance = pos, distance[map.get_index(pos)]
+        for dx, dy in (0, 1), (1, 0), (-1, 0), (0, -1):
+            next_pos = pos[0] + dx, pos[1] + dy
+            if 0 <= next_pos[0] < width and 0 <= next_pos[1] < map.height:
+                next_distance = distance[map.get_index(next_pos)]
+                if next_distance != -1 and (best_distance == -1 or next_distance < best_distance):
+                    best, best_distance = next_pos, next_distance
+        return best
+
+    def __call__(self, game, tick):
+        hero_x, hero_y = game.hero.get_pixel_pos()
+        target_x, target_y = game.map.get_tile_coords(self.next_tile(game.map, game.hero.get_pos()))
+        dx = (target_x > hero_x) - (target_x < hero_x)
+        dy = (target_y > hero_y) - (target_y < hero_y)
+        enemy, distance = nearest_enemy(hero_x, hero_y)
+        if enemy is None or distance > self.sight ** 2:
+            target = game.camera.to_screen((target_x + TILE_SIZE // 2, target_y + TILE_SIZE // 2))
+            return main.Inputs(dx, dy, target)
+        weapon = 2 if distance < self.shotgun_range ** 2 and 'shotgun' in main.weapons else 1
+        shoot = tick >= self.next_shot
+        if shoot:
+            self.next_shot = tick + self.cooldown
+        return main.Inputs(dx, dy, game.camera.to_screen(enemy), shoot, weapon=weapon)
+
+
+class RandomPolicy:
+    """
+    Случайный игрок: раз в несколько тиков меняет направление, стреляет в случайную точку
+    или в ближайшего врага. Нужен как нижняя граница для сравнения со ScriptedPolicy.
+    """
+
+    def __init__(self, game, rng, turn_every=30, shoot_chance=0.1):
+        self.rng = rng
+        self.turn_every = turn_every
+        self.shoot_chance = shoot_chance
+        self.direction = (0, 0)
+
+    def __call__(self, game, tick):
+        rng = self.rng
+        if tick % self.turn_every == 0:
+            self.direction = rng.randint(-1, 1), rng.randint(-1, 1)
+        target = rng.randrange(WINDOW_WIDTH), rng.randrange(WINDOW_HEIGHT)
+        enemy = nearest_enemy(*game.hero.get_pixel_pos())[0]
+        if enemy is not None and rng.random() < 0.5:
+            target = game.camera.to_screen(enemy)
+        return main.Inputs(*self.direction, target, rng.random() < self.shoot_chance,
+                           weapon=rng.randint(1, len(main.weapons)) if main.weapons else 0)
+
+
+POLICIES = {
+    'scripted': ScriptedPolicy,
+    'random': RandomPolicy,
+}
+
+
+def arrival_weapons(map_number):  # Оружие, с которым игрок приходит на карту: всё, что лежит на предыдущих картах
+    if map_number not in arrival_weapons_cache:
+        weapons = []
+        for number in range(1, map_number):
+            tiles = set(main.levels.get(f'map{number}.tmx').tiles)
+            weapons += [name for tile_id, name in WEAPON_TILES.items() if tile_id in tiles and name not in weapons]
+        arrival_weapons_cache[map_number] = weapons
+    return arrival_weapons_cache[map_number]
+
+
+def reset_round(map_number, difficulty):  # Чистое состояние игры в начале карты map_number
+    main.enemies.clear()
+    main.bullets.clear()
+    main.set_difficulty(difficulty)
+    main.weapons[:] = arrival_weapons(map_number)  # Как в игре: оружие переходит с прошлых карт через change_map
+    main.kills = 0
+    main.win = main.lose = False
+    main.map_number = map_number
+    map = main.levels.get(f'map{map_number}.tmx')
+    map.reset_flow_field()
+    map.spawn_enemies()
+    hero = main.Hero(map.spawn_pos, 'hero.png', PLAYER_HP, 1001)
+    hero.weapon = main.weapons[-1] if main.weapons else None
+    return main.Game(map, hero, ai_budget_ms=None)  # ИИ без бюджета по времени: раунд с тем же сидом повторяется
+
+
+def run_round(task):  # Один раунд в процессе пула. task - (номер карты, сложность, политика, сид, лимит тиков, render)
+    map_number, difficulty, policy_name, seed, max_ticks, render = task
+    rng = random.Random(seed)
+    game = reset_round(map_number, difficulty)
+    policy = POLICIES[policy_name](game, rng)
+    screen = main.pygame.display.get_surface() if render else None
+    start_ammo = game.hero.ammo
+    samples = []
+    outcome, tick = 'timeout', max_ticks
+    for i in range(max_ticks):
+        if main.lose:
+            outcome, tick = 'lose', i
+            break
+        if main.win or main.map_number != map_number:
+            outcome, tick = 'win', i
+            break
+        inputs = policy(game, i)
+        start = time.perf_counter()
+        game.step(inputs, TICK)
+        if screen is not None:
+            game.render(screen)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'map': map_number,
+        'difficulty': difficulty,
+        'policy': policy_name,
+        'seed': seed,
+        'outcome': outcome,
+        'ticks': tick,
+        'time_s': round(tick * TICK, 3),
+        'kills': main.kills,
+        'ammo_used': start_ammo - game.hero.ammo,
+        'frame_ms_mean': sum(samples) / len(samples) * 1000 if samples else 0,
+        'frame_ms_p95': samples[int(0.95 * len(samples))] * 1000 if samples else 0,
+    }
+
+
+def mean(values):
+    return round(sum(values) / len(values), 3) if values else None
+
+
+def aggregate(rounds):  # Сводка по (карта, сложность, политика)
+    groups = {}
+    for result in rounds:
+        groups.setdefault((result['map'], result['difficulty'], result['policy']), []).append(result)
+    report = []
+    for (map_number, difficulty, policy), results in sorted(groups.items()):
+        outcomes = [result['outcome'] for result in results]
+        report.append({
+            'map': f'map{map_number}.tmx',
+            'difficulty': difficulty,
+            'policy': policy,
+            'rounds': len(results),
+            'win_rate': round(outcomes.count('win') / len(results), 3),
+            'lose_rate': round(outcomes.count('lose') / len(results), 3),
+            'timeout_rate': round(outcomes.count('timeout') / len(results), 3),
+            'kills_mean': mean([result['kills'] for result in results]),
+            'time_to_win_s': mean([result['time_s'] for result in results if result['outcome'] == 'win']),
+            'time_to_lose_s': mean([result['time_s'] for result in results if result['outcome'] == 'lose']),
+            'ammo_used_mean': mean([result['ammo_used'] for result in results]),
+            'frame_ms_mean': mean([result['frame_ms_mean'] for result in results]),
+            'frame_ms_p95': mean([result['frame_ms_p95'] for result in results]),
+        })
+    return report
+
+
+def run(args):
+    overrides = dict(args.set)
+    tasks = [(map_number, difficulty, policy, args.seed + i, args.max_ticks, args.render)
+             for map_number in args.maps
+             for difficulty in args.difficulties
+             for policy in args.policies
+             for i in range(args.rounds)]
+    workers = args.workers or os.cpu_count()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(overrides,)) as pool:
+        rounds = list(pool.map(run_round, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'workers': workers,
+            'rounds': len(tasks),
+            'wall_s': round(time.perf_counter() - start, 3),
+            'max_ticks': args.max_ticks,
+            'seed': args.seed,
+            'render': args.render,
+            'overrides': overrides,
+        },
+        'summary': aggregate(rounds),
+    }
+    if args.rounds_detail:
+        report['rounds'] = rounds
+    return report
+
+
+def parse_override(text):  # 'ENEMY_HP=150' -> ('ENEMY_HP', 150)
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'expected NAME=VALUE, got {text!r}')
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError(f'bad value for {name}: {value!r}')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Hot Rooms batch simulation')
+    parser.add_argument('--maps', nargs='+', type=int, default=list(range(1, MAPS_COUNT + 1)))
+    parser.add_argument('--difficulties', nargs='+', choices=DIFFICULTIES, default=list(DIFFICULTIES))
+    parser.add_argument('--policies', nargs='+', choices=sorted(POLICIES), default=['scripted', 'random'])
+    parser.add_argument('--rounds', type=int, default=20, help='раундов на сочетание карты, сложности и политики')
+    parser.add_argument('--max-ticks', type=int, default=FPS * 120, help='лимит тиков на раунд')
+    parser.add_argument('--workers', type=int, default=None, help='процессов в пуле (по умолчанию по числу ядер)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--render', action='store_true', help='включать Game.render в стоимость кадра')
+    parser.add_argument('--set', nargs='+', type=parse_override, default=[], metavar='NAME=VALUE',
+                        help='подменить константы из constants.py на время прогона')
+    parser.add_argument('--rounds-detail', action='store_true', help='добавить в отчёт результаты каждого раунда')
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = run(args)
+    if args.output:
+        with open(args.output, mode='w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)